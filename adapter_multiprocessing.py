@@ -0,0 +1,57 @@
+import multiprocessing
+import numpy
+
+from domain import Collisions, find_first_collisions, Map
+
+_CONTEXT = multiprocessing.get_context('spawn')
+
+_shared_cells = None
+_shared_map = None
+
+def _initialize_worker(cells):
+  global _shared_cells, _shared_map
+  _shared_cells, _shared_map = cells, None
+
+def _worker_map(generation, width):
+  global _shared_map
+  if _shared_map is None or _shared_map[0] != generation:
+    _shared_map = (generation, Map(bytes(_shared_cells), [], width))
+  return _shared_map[1]
+
+def _raycast_strip(task):
+  (generation, width, start, directions, max_distance) = task
+  return find_first_collisions(_worker_map(generation, width), start, directions, max_distance, skip_empty_space=True)
+
+class ParallelRaycaster:
+  def __init__(self, processes=None, strips_per_process=2):
+    self.__processes = processes or _CONTEXT.cpu_count()
+    self.__strips = self.__processes * strips_per_process
+    self.__pool = None
+    self.__cells = None
+    self.__world_map = None
+    self.__generation = 0
+
+  def __call__(self, world_map, start, directions, max_distance):
+    self.__share(world_map)
+    tasks = [(self.__generation, world_map.width, start, strip, max_distance) for strip in numpy.array_split(directions, self.__strips)]
+    results = self.__pool.map(_raycast_strip, tasks)
+    return Collisions(*(numpy.concatenate(field) for field in zip(*results)))
+
+  def __share(self, world_map):
+    if world_map is self.__world_map:
+      return
+    if self.__cells is None or len(self.__cells) != len(world_map.cells):
+      self.close()
+      self.__cells = _CONTEXT.RawArray('B', len(world_map.cells))
+      self.__pool = _CONTEXT.Pool(self.__processes, initializer=_initialize_worker, initargs=(self.__cells, ))
+    self.__cells[:] = world_map.cells
+    self.__world_map = world_map
+    self.__generation += 1
+
+  def close(self):
+    if self.__pool is not None:
+      self.__pool.terminate()
+      self.__pool.join()
+      self.__pool = None
+    self.__cells = None
+    self.__world_map = None
@@ -0,0 +1,244 @@
+import os
+import os.path
+import queue
+import struct
+import threading
+import time
+import zlib
+
+from adapter_zmq import BinaryCodec
+from domain import Map, Player, PlayerInput, ServerSnapshot
+
+_RECORD_TYPES = {
+  'activate': str,
+  'input': PlayerInput,
+  'join': str,
+  'leave': str,
+  'move': Player,
+  'tick': float,
+}
+_RECORD_NAMES = sorted(_RECORD_TYPES)
+
+_RECORD_HEADER = struct.Struct('<II')
+_RECORD_PREFIX = struct.Struct('<QdB')
+_SNAPSHOT_MAGIC = b'RCS1'
+_SNAPSHOT_HEADER = struct.Struct('<4sQ')
+_UINT32 = struct.Struct('<I')
+
+_MAX_QUEUED_WRITES = 10000
+_QUEUE_POLL_INTERVAL = 0.1
+
+_SNAPSHOT_FILE = 'snapshot.bin'
+_SEGMENT_PREFIX = 'journal-'
+_SEGMENT_SUFFIX = '.bin'
+
+def _segment_name(first_sequence):
+  return '{}{:020d}{}'.format(_SEGMENT_PREFIX, first_sequence, _SEGMENT_SUFFIX)
+
+def _segment_sequence(filename):
+  return int(filename[len(_SEGMENT_PREFIX):-len(_SEGMENT_SUFFIX)])
+
+def _pack_items(codec, Type, items):
+  parts = [_UINT32.pack(len(items))]
+  for item in items:
+    data = codec.encode(Type, item)
+    parts.extend([_UINT32.pack(len(data)), data])
+  return parts
+
+def _unpack_items(codec, Type, data, offset):
+  count, = _UINT32.unpack_from(data, offset)
+  offset += _UINT32.size
+  items = []
+  for _ in range(count):
+    length, = _UINT32.unpack_from(data, offset)
+    offset += _UINT32.size
+    items.append(codec.decode(Type, data[offset:offset+length]))
+    offset += length
+  return items, offset
+
+def _read_segment(codec, path):
+  with open(path, 'rb') as file:
+    data = file.read()
+  records = []
+  offset = 0
+  while offset + _RECORD_HEADER.size <= len(data):
+    length, checksum = _RECORD_HEADER.unpack_from(data, offset)
+    payload = data[offset+_RECORD_HEADER.size:offset+_RECORD_HEADER.size+length]
+    if len(payload) < length or zlib.crc32(payload) != checksum:
+      break
+    sequence, record_time, name_index = _RECORD_PREFIX.unpack_from(payload)
+    name = _RECORD_NAMES[name_index]
+    records.append((sequence, record_time, name, codec.decode(_RECORD_TYPES[name], payload[_RECORD_PREFIX.size:])))
+    offset += _RECORD_HEADER.size + length
+  return records, offset, len(data)
+
+def _segment_paths(path):
+  return [os.path.join(path, filename) for filename in sorted(os.listdir(path)) if filename.startswith(_SEGMENT_PREFIX)]
+
+def read_journal(path):
+  codec = BinaryCodec()
+  records = []
+  for segment in _segment_paths(path):
+    segment_records, _, _ = _read_segment(codec, segment)
+    records.extend((record_time, name, input_data) for _, record_time, name, input_data in segment_records)
+  return records
+
+def _fsync_directory(path):
+  descriptor = os.open(path, os.O_RDONLY)
+  try:
+    os.fsync(descriptor)
+  finally:
+    os.close(descriptor)
+
+class _Writer(threading.Thread):
+  def __init__(self, path, keep_segments):
+    super().__init__(name='journal-writer', daemon=True)
+    self.__path = path
+    self.__keep_segments = keep_segments
+    self.__queue = queue.Queue(maxsize=_MAX_QUEUED_WRITES)
+    self.__file = None
+    self.error = None
+
+  def put(self, item):
+    while True:
+      self.check()
+      try:
+        self.__queue.put(item, timeout=_QUEUE_POLL_INTERVAL)
+        return
+      except queue.Full:
+        pass
+
+  def check(self):
+    if self.error is not None:
+      raise IOError('Journal writer failed') from self.error
+
+  def run(self):
+    try:
+      self.__run()
+    except Exception as e:
+      self.error = e
+    finally:
+      if self.__file:
+        self.__file.close()
+
+  def __run(self):
+    running = True
+    while running:
+      batch = [self.__queue.get()]
+      while True:
+        try:
+          batch.append(self.__queue.get_nowait())
+        except queue.Empty:
+          break
+      for item in batch:
+        if item[0] == 'record':
+          self.__write_record(*item[1:])
+        elif item[0] == 'snapshot':
+          self.__write_snapshot(*item[1:])
+        elif item[0] == 'close':
+          running = False
+      self.__commit()
+
+  def __write_record(self, sequence, data):
+    if self.__file is None:
+      self.__file = open(os.path.join(self.__path, _segment_name(sequence)), 'ab')
+    self.__file.write(data)
+
+  def __commit(self):
+    if self.__file:
+      self.__file.flush()
+      os.fsync(self.__file.fileno())
+
+  def __write_snapshot(self, sequence, data):
+    self.__commit()
+    if self.__file:
+      self.__file.close()
+      self.__file = None
+
+    temporary_path = os.path.join(self.__path, _SNAPSHOT_FILE + '.tmp')
+    with open(temporary_path, 'wb') as file:
+      file.write(data)
+      file.flush()
+      os.fsync(file.fileno())
+    os.replace(temporary_path, os.path.join(self.__path, _SNAPSHOT_FILE))
+    _fsync_directory(self.__path)
+
+    if self.__keep_segments:
+      return
+    for filename in os.listdir(self.__path):
+      if filename.startswith(_SEGMENT_PREFIX) and _segment_sequence(filename) <= sequence:
+        os.remove(os.path.join(self.__path, filename))
+
+class Journal:
+  def __init__(self, path, keep_segments=False):
+    self.__path = path
+    self.__codec = BinaryCodec()
+    os.makedirs(path, exist_ok=True)
+    self.__snapshot, self.__records = self.__load()
+    self.__next_sequence = max([self.__snapshot_sequence] + [record[0] for record in self.__records[-1:]]) + 1
+    self.__writer = _Writer(path, keep_segments)
+    self.__writer.start()
+
+  @property
+  def snapshot(self):
+    return self.__snapshot
+
+  def replay(self):
+    return [(name, input_data) for _, _, name, input_data in self.__records_since(self.__snapshot_sequence)]
+
+  def __records_since(self, sequence):
+    return [record for record in self.__records if record[0] > sequence]
+
+  def record(self, name, input_data):
+    payload = _RECORD_PREFIX.pack(self.__next_sequence, time.time(), _RECORD_NAMES.index(name)) + \
+      self.__codec.encode(_RECORD_TYPES[name], input_data)
+    self.__writer.put(('record', self.__next_sequence, _RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload))
+    self.__next_sequence += 1
+
+  def save_snapshot(self, snapshot):
+    sequence = self.__next_sequence - 1
+    parts = [_SNAPSHOT_HEADER.pack(_SNAPSHOT_MAGIC, sequence)]
+    parts.extend(_pack_items(self.__codec, Map, [snapshot.world_map]))
+    parts.extend(_pack_items(self.__codec, Player, snapshot.players))
+    parts.extend(_pack_items(self.__codec, PlayerInput, snapshot.inputs))
+    data = b''.join(parts)
+    self.__writer.put(('snapshot', sequence, data + _UINT32.pack(zlib.crc32(data))))
+
+  def close(self):
+    self.__writer.put(('close', ))
+    self.__writer.join()
+    self.__writer.check()
+
+  def __load(self):
+    self.__snapshot_sequence = 0
+    snapshot = self.__load_snapshot()
+    records = []
+    segments = _segment_paths(self.__path)
+    for index, segment in enumerate(segments):
+      segment_records, valid_length, length = _read_segment(self.__codec, segment)
+      records.extend(segment_records)
+      if valid_length == length:
+        continue
+      if index < len(segments) - 1:
+        raise ValueError('Corrupt record in {} at byte {}'.format(segment, valid_length))
+      with open(segment, 'r+b') as file:
+        file.truncate(valid_length)
+    return snapshot, records
+
+  def __load_snapshot(self):
+    path = os.path.join(self.__path, _SNAPSHOT_FILE)
+    if not os.path.exists(path):
+      return None
+    with open(path, 'rb') as file:
+      data = file.read()
+    body, (checksum, ) = data[:-_UINT32.size], _UINT32.unpack(data[-_UINT32.size:])
+    magic, sequence = _SNAPSHOT_HEADER.unpack_from(body)
+    if magic != _SNAPSHOT_MAGIC or zlib.crc32(body) != checksum:
+      raise ValueError('Corrupt snapshot in {}'.format(path))
+    offset = _SNAPSHOT_HEADER.size
+    (world_map, ), offset = _unpack_items(self.__codec, Map, body, offset)
+    players, offset = _unpack_items(self.__codec, Player, body, offset)
+    inputs, offset = _unpack_items(self.__codec, PlayerInput, body, offset)
+    self.__snapshot_sequence = sequence
+    return ServerSnapshot(world_map, players, inputs)
+
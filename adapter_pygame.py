@@ -1,11 +1,14 @@
 import collections
+import functools
+import heapq
 import json
 import math
 import numpy
 import os.path
 import pygame
 
-from domain import Direction, smallest_number, find_first_collision, Input, LineSegment, Map, Material, Object, Player, Position, SquareSide
+from domain import Angle, Direction, smallest_number, find_first_collisions, Input, Map, Material, Object, Player, Position, SquareSide
+from metrics import NullMetrics
 
 pygame.init()
 pygame.font.init()
@@ -33,22 +36,19 @@ def _load_json_document(path):
   with open(path) as file:
     return json.load(file)
 
-def _load_color_to_value_mapping(path, enum_class):
+def _load_color_to_id_mapping(path, enum_class):
   document = _load_json_document(path)
-  return { _color_tuple_from_json(color): enum_class[value.upper()] for color, value in document.items() }
+  return { _color_tuple_from_json(color): enum_class[value.upper()].value for color, value in document.items() }
 
-def _load_map_layer(path, color_to_value, default):
+def _load_map_layer(path, color_to_id, default_id):
   surface = pygame.image.load(path)
-  width, height = surface.get_width(), surface.get_height()
-  layer = [ default, ] * (width * height)
-
-  for x in range(0, width):
-    for y in range(0, height):
-      color = surface.get_at((x, y))
-      key = (int(color.r), int(color.g), int(color.b))
-      layer[y*width + x] = color_to_value.get(key, default) if color.a > 0 else default
-
-  return layer, width
+  colors = pygame.surfarray.array3d(surface).astype(numpy.uint32)
+  keys = (colors[:, :, 0] << 16) | (colors[:, :, 1] << 8) | colors[:, :, 2]
+  unique_keys, inverse = numpy.unique(keys, return_inverse=True)
+  lookup = numpy.array([color_to_id.get((key >> 16, (key >> 8) & 0xff, key & 0xff), default_id) for key in unique_keys.tolist()], dtype=numpy.uint8)
+  layer = lookup[inverse].reshape(keys.shape)
+  layer[pygame.surfarray.array_alpha(surface) == 0] = default_id
+  return layer.T
 
 def load_color_scheme(path):
   colors = _load_json_document(os.path.join(path, 'colors.json'))
@@ -60,25 +60,57 @@ def load_player_spawn(path):
   spawn_position, spawn_forward = _position_from_json(spawn['position']), _direction_from_json(spawn['forward'])
   return Player('steve', spawn_position, spawn_forward)
 
-def load_map(path):
-  color_to_material = _load_color_to_value_mapping(os.path.join(path, 'materials.json'), Material)
-  color_to_object = _load_color_to_value_mapping(os.path.join(path, 'objects.json'), Object)
+_MAP_SOURCES = [ 'materials.json', 'materials.png', 'objects.json', 'objects.png', ]
+_MAP_CACHE = 'map_cache.npz'
+_NO_OBJECT = 255
+
+def _map_source_mtimes(path):
+  return numpy.array([os.path.getmtime(os.path.join(path, source)) for source in _MAP_SOURCES])
+
+def _load_map_cache(path, source_mtimes):
+  try:
+    with numpy.load(os.path.join(path, _MAP_CACHE)) as cache:
+      if numpy.array_equal(cache['source_mtimes'], source_mtimes):
+        return cache['materials'], cache['objects']
+  except Exception:
+    pass
+  return None
+
+def _save_map_cache(path, source_mtimes, materials, objects):
+  temporary_path = os.path.join(path, '{}.{}.tmp'.format(_MAP_CACHE, os.getpid()))
+  try:
+    with open(temporary_path, 'wb') as file:
+      numpy.savez(file, source_mtimes=source_mtimes, materials=materials, objects=objects)
+    os.replace(temporary_path, os.path.join(path, _MAP_CACHE))
+  except IOError:
+    try:
+      os.remove(temporary_path)
+    except OSError:
+      pass
+
+def _load_map_layers(path):
+  color_to_material = _load_color_to_id_mapping(os.path.join(path, 'materials.json'), Material)
+  color_to_object = _load_color_to_id_mapping(os.path.join(path, 'objects.json'), Object)
+
+  materials = _load_map_layer(os.path.join(path, 'materials.png'), color_to_material, default_id=Material.FLOOR.value)
+  objects = _load_map_layer(os.path.join(path, 'objects.png'), color_to_object, default_id=_NO_OBJECT)
+  return materials, objects
 
-  materials, width = _load_map_layer(os.path.join(path, 'materials.png'), color_to_material, default=Material.FLOOR)
-  object_layer, object_width = _load_map_layer(os.path.join(path, 'objects.png'), color_to_object, default=None)
-
-  square_to_center_offset = Direction(0.5, 0.5)
-  objects = []
+def load_map(path):
+  source_mtimes = _map_source_mtimes(path)
+  cached = _load_map_cache(path, source_mtimes)
 
-  def to_position(index):
-    return Position(index % object_width, int(index/object_width))
+  if cached is None:
+    materials, object_layer = _load_map_layers(path)
+    _save_map_cache(path, source_mtimes, materials, object_layer)
+  else:
+    materials, object_layer = cached
 
-  for index, object in enumerate(object_layer):
-    if object is not None:
-      position = to_position(index) + square_to_center_offset
-      objects.append((object, position))
+  ys, xs = numpy.nonzero(object_layer != _NO_OBJECT)
+  object_ids = object_layer[ys, xs]
+  objects = [(Object(object_id), Position(x + 0.5, y + 0.5)) for object_id, x, y in zip(object_ids.tolist(), xs.tolist(), ys.tolist())]
 
-  return Map(materials, objects, width)
+  return Map(materials, objects, materials.shape[1])
 
 def load_links(path):
   links = {}
@@ -137,6 +169,15 @@ class Color:
 
 ColorScheme = collections.namedtuple('ColorScheme', [ 'ceiling', 'floor' ])
 
+@functools.lru_cache(maxsize=8)
+def _create_ray_table(width, view_scale):
+  normalized_x = (2*numpy.arange(width)) / (width + smallest_number) - 1
+  right_scale = view_scale * normalized_x
+  inverse_length = 1 / numpy.sqrt(1 + right_scale*right_scale)
+  rays = numpy.stack((right_scale*inverse_length, inverse_length), axis=-1)
+  rays.flags.writeable = False
+  return rays
+
 class _Camera:
   def __init__(self, player, size, field_of_view):
     self.position = player.position
@@ -145,12 +186,20 @@ class _Camera:
     self.__width = size.width
     self.forward = player.forward.normalize()
     self.__right = Direction(-self.forward.y, self.forward.x)
+    self.half_angle = Angle.from_radians(math.atan(self.__fov_scale * self.__aspect_ratio))
+    self.__rays = _create_ray_table(self.__width, self.__fov_scale * self.__aspect_ratio)
+
+  def view_half_width(self, scale):
+    return scale * self.__fov_scale
 
-  def direction_for_column(self, column):
-    normalized_x = self.__convert_column_to_normalized_coordinate(column)
-    right_scale = self.__fov_scale * self.__aspect_ratio * normalized_x
-    direction = self.forward + self.__right*right_scale
-    return direction.normalize()
+  def directions_for_columns(self):
+    right, ahead = self.__rays[:, 0], self.__rays[:, 1]
+    x = self.forward.x*ahead + self.__right.x*right
+    y = self.forward.y*ahead + self.__right.y*right
+    return numpy.stack((x, y), axis=-1)
+
+  def fisheye_factors(self):
+    return self.__rays[:, 1]
 
   def column_for_direction(self, direction_in_view_coordinates):
     direction = direction_in_view_coordinates.normalize()
@@ -158,9 +207,6 @@ class _Camera:
     normalized_x = right_scale / (self.__fov_scale * self.__aspect_ratio + smallest_number)
     return self.__convert_normalized_coordinate_to_column(normalized_x)
 
-  def __convert_column_to_normalized_coordinate(self, column):
-    return (2*column) / (self.__width + smallest_number) - 1
-
   def __convert_normalized_coordinate_to_column(self, coordinate):
     return int((self.__width * (coordinate + 1)) / 2)
 
@@ -184,24 +230,71 @@ def _create_checkerboard_texture():
   surface.fill(red, pygame.Rect(half_size, half_size, half_size, half_size))
   return surface
 
+_SPRITE_SIZE_QUANTUM = 4
+_SPRITE_CACHE_SIZE = 64
+_LABEL_CACHE_SIZE = 256
+_LABEL_SCALE_QUANTUM = 0.125
+_LABEL_MIN_SCALE = 0.25
+_LABEL_FULL_SIZE_DISTANCE = 2
+_LABEL_FOREGROUND = (255, 255, 255)
+_LABEL_BACKGROUND = (50, 50, 50)
+
+class _LruCache:
+  def __init__(self, max_size):
+    self.__max_size = max_size
+    self.__items = collections.OrderedDict()
+
+  def get(self, key, create):
+    if key in self.__items:
+      self.__items.move_to_end(key)
+      return self.__items[key]
+
+    item = create()
+    self.__items[key] = item
+    if len(self.__items) > self.__max_size:
+      self.__items.popitem(last=False)
+    return item
+
+  def __len__(self):
+    return len(self.__items)
+
 class Renderer:
-  def __init__(self, window_size, materials, objects, player_texture, font, field_of_view, draw_distance, far_color, shade_scale, object_scale):
+  def __init__(self, window_size, materials, objects, player_texture, font, field_of_view, draw_distance, far_color, shade_scale, object_scale, scale_labels=False, render_scale=1, raycaster=None, metrics=NullMetrics()):
     self.__screen = pygame.display.set_mode(window_size)
-    self.__size = _Size(self.__screen.get_width(), self.__screen.get_height())
-    self.__buffer = numpy.zeros(window_size, dtype=numpy.uint32)
+    self.__window_size = _Size(self.__screen.get_width(), self.__screen.get_height())
     self.__field_of_view, self.__draw_distance = field_of_view, draw_distance
     self.__far_color, self.__shade_scale = self.__screen.map_rgb(_to_pygame_color(far_color)), shade_scale
     self.__object_scale = object_scale
     self.__font = font
-    self.__z_buffer = numpy.zeros((self.__size.width, ), dtype='float32')
+    self.__metrics = metrics
+    self.__raycaster = raycaster or (lambda world_map, start, directions, max_distance: find_first_collisions(world_map, start, directions, max_distance, skip_empty_space=True))
 
-    self.__materials = { material: self.__convert_texture_to_array(texture) for material, texture in materials.items() }
-    self.__shaded_materials = { material: self.__convert_texture_to_array(_darken_surface(texture, shade_scale)) for material, texture in materials.items() }
     self.__objects = objects
     self.__player_texture = player_texture
 
     self.__checkerboard = _create_checkerboard_texture()
-    self.__checkerboard_array = self.__convert_texture_to_array(self.__checkerboard)
+    self.__sprites = _LruCache(_SPRITE_CACHE_SIZE)
+    self.__labels = _LruCache(_LABEL_CACHE_SIZE)
+    self.__scale_labels = scale_labels
+    self.__color_mask = sum(self.__screen.get_masks()[:3])
+    self.__material_atlas = self.__create_material_atlas(materials, shade_scale)
+    self.__render_scale = None
+    self.set_render_scale(render_scale)
+
+  @property
+  def render_scale(self):
+    return self.__render_scale
+
+  def set_render_scale(self, render_scale):
+    if render_scale == self.__render_scale:
+      return
+    self.__render_scale = render_scale
+    self.__size = _Size(max(1, int(round(self.__window_size.width * render_scale))), max(1, int(round(self.__window_size.height * render_scale))))
+    self.__frame = pygame.Surface(self.__size, 0, self.__screen) if self.__size != self.__window_size else self.__screen
+    self.__buffer = numpy.zeros(self.__size, dtype=numpy.uint32)
+    self.__background = numpy.zeros(self.__size.height, dtype=numpy.uint32)
+    self.__z_buffer = numpy.zeros((self.__size.width, ), dtype='float32')
+    self.__texture_rows = self.__create_texture_row_table()
 
   def __convert_texture_to_array(self, texture):
     texture_in_screen_color_space = texture.convert()
@@ -209,48 +302,99 @@ class Renderer:
     transposed = mapped_colors.T
     return transposed
 
+  def __create_material_atlas(self, materials, shade_scale):
+    # Every material is scaled to the size of the first texture so that all of them fit in one array.
+    size = next(iter(materials.values()), self.__checkerboard).get_size()
+    textures = { material: pygame.transform.scale(materials.get(material, self.__checkerboard), size) for material in Material }
+    unshaded = { material: self.__convert_texture_to_array(texture) for material, texture in textures.items() }
+    shaded = { material: self.__convert_texture_to_array(_darken_surface(texture, shade_scale)) for material, texture in textures.items() }
+    layers = [variant[material] for material in sorted(Material, key=lambda material: material.value) for variant in (unshaded, shaded)]
+    return numpy.stack(layers)
+
+  def __create_texture_row_table(self):
+    _, texture_height, texture_width = self.__material_atlas.shape
+    dtype = numpy.int16 if (texture_height-1)*texture_width <= numpy.iinfo(numpy.int16).max else numpy.int32
+    table = numpy.zeros((self.__size.height + 1, self.__size.height), dtype=dtype)
+    for height in range(1, self.__size.height + 1):
+      table[height, :height] = numpy.linspace(0, texture_height-1, num=height, dtype=numpy.uint32) * texture_width
+    return table.ravel()
+
   def draw(self, color_scheme, world_map, player, other_players):
     half_height = int(self.__size.height / 2)
-    self.__buffer[:, :half_height] = self.__screen.map_rgb(_to_pygame_color(color_scheme.ceiling))
-    self.__buffer[:, half_height:] = self.__screen.map_rgb(_to_pygame_color(color_scheme.floor))
+    self.__background[:half_height] = self.__screen.map_rgb(_to_pygame_color(color_scheme.ceiling))
+    self.__background[half_height:] = self.__screen.map_rgb(_to_pygame_color(color_scheme.floor))
+    self.__buffer[:] = self.__background
     self.__z_buffer.fill(self.__draw_distance)
 
     camera = _Camera(player, self.__size, self.__field_of_view)
 
-    for x in range(0, self.__size.width):
-      direction = camera.direction_for_column(x)
-      line_segment = LineSegment(start=camera.position, end=camera.position+direction*self.__draw_distance)
-      collision = find_first_collision(world_map, line_segment)
+    with self.__metrics.time('renderer.raycast'):
+      directions = camera.directions_for_columns()
+      collisions = self.__raycaster(world_map, camera.position, directions, self.__draw_distance)
+      corrected_distances = collisions.distance * camera.fisheye_factors()
+
+    with self.__metrics.time('renderer.draw_column'):
+      self.__draw_columns(world_map, directions, collisions, corrected_distances)
+
+    with self.__metrics.time('renderer.draw_object'):
+      objects = world_map.object_index.in_view(camera.position, camera.forward, self.__draw_distance, camera.half_angle, margin=camera.view_half_width(self.__object_scale))
+      objects = [(self.__objects.get(object, self.__checkerboard), position) for (object, position) in objects]
+      players = sorted(((self.__player_texture, player.position) for player in other_players), key=lambda t: (t[1] - camera.position).length())
+      for (texture, position) in heapq.merge(objects, players, key=lambda t: (t[1] - camera.position).length()):
+        self.__draw_object(texture, position, camera)
+
+    with self.__metrics.time('renderer.blit'):
+      pygame.surfarray.blit_array(self.__frame, self.__buffer)
+      if self.__frame is not self.__screen:
+        pygame.transform.scale(self.__frame, self.__window_size, self.__screen)
 
-      if collision is None:
-        (start, end) =  self.__get_vertical_span(self.__draw_distance)
-        self.__buffer[x, start:end] = self.__far_color
-      else:
-        fish_eye_corrected_distance = collision.distance * direction.dot(camera.forward)
-        (start, end) = self.__get_vertical_span(fish_eye_corrected_distance)
+    with self.__metrics.time('renderer.draw_text'):
+      for player in other_players:
+        self.__draw_text(player.name, player.position, camera)
 
-        material = world_map.material(collision.position)
-        use_shade = collision.side != SquareSide.HORIZONTAL
-        flip_texture = collision.side == SquareSide.HORIZONTAL and direction.x < 0 or \
-          collision.side == SquareSide.VERTICAL and direction.y > 0
-        wall_x = collision.wall
+    with self.__metrics.time('renderer.flip'):
+      pygame.display.flip()
 
-        if collision.distance < self.__z_buffer[x]:
-          column = pygame.Rect(x, start, 1, end-start+1)
-          self.__draw_column(column, material, use_shade, flip_texture, wall_x)
-          self.__z_buffer[x] = collision.distance
+  def __draw_columns(self, world_map, directions, collisions, corrected_distances):
+    (far_start, far_end) = self.__get_vertical_span(self.__draw_distance)
+    self.__buffer[~collisions.hit, far_start:far_end] = self.__far_color
 
-    pygame.surfarray.blit_array(self.__screen, self.__buffer)
+    columns = numpy.nonzero(collisions.hit & (collisions.distance < self.__z_buffer))[0]
+    if columns.size == 0:
+      return
+
+    (starts, ends) = self.__get_vertical_spans(corrected_distances[columns])
+    heights = ends - starts + 1
+    _, texture_height, texture_width = self.__material_atlas.shape
+
+    horizontal = collisions.side[columns] == SquareSide.HORIZONTAL.value
+    flip_texture = horizontal & (directions[columns, 0] < 0) | ~horizontal & (directions[columns, 1] > 0)
+    layers = 2*world_map.material_ids(collisions.x[columns], collisions.y[columns]).astype(numpy.intp) + ~horizontal
 
-    for (object, position) in sorted(world_map.objects, key=lambda t: (t[1] - camera.position).length()):
-      texture = self.__objects.get(object, self.__checkerboard)
-      self.__draw_object(texture, position, camera)
+    wall_x = collisions.wall[columns]
+    texture_x = numpy.clip((wall_x - numpy.floor(wall_x)) * texture_width, 0, texture_width-1).astype(numpy.intp)
+    texture_x = numpy.where(flip_texture, texture_width-1 - texture_x, texture_x)
 
-    for player in other_players:
-      self.__draw_object(self.__player_texture, player.position, camera)
-      self.__draw_text(player.name, player.position, camera)
+    top, bottom = starts.min(), ends.max() + 1
+    rows = numpy.arange(top, bottom) - starts[:, numpy.newaxis]
+    inside = (rows >= 0) & (rows < heights[:, numpy.newaxis])
+    texel_rows = self.__texture_rows.take(rows + (heights*self.__size.height)[:, numpy.newaxis], mode='clip')
+    texels = texel_rows + (layers*texture_height*texture_width + texture_x)[:, numpy.newaxis]
 
-    pygame.display.flip()
+    background = self.__background[top:bottom]
+    self.__buffer[columns, top:bottom] = numpy.where(inside, self.__material_atlas.take(texels, mode='clip'), background)
+    self.__z_buffer[columns] = collisions.distance[columns]
+
+  def __get_vertical_spans(self, distances):
+    center_y = self.__size.height / 2
+
+    original_height = self.__size.height / (distances + smallest_number)
+    half_line_height = original_height / 2
+
+    starts = numpy.maximum(0, numpy.trunc(center_y - half_line_height))
+    ends = numpy.minimum(numpy.trunc(center_y + half_line_height), self.__size.height - 1)
+
+    return (starts.astype(numpy.intp), ends.astype(numpy.intp))
 
   def __get_vertical_span(self, distance, scale=1):
     center_y = self.__size.height / 2
@@ -265,23 +409,6 @@ class Renderer:
 
     return (start, end)
 
-  def __draw_column(self, rectangle, material, use_shade, flip_texture, wall_x):
-    x, y_start, height = rectangle.x, rectangle.y, rectangle.height
-    y_end = y_start + height
-
-    materials = self.__shaded_materials if use_shade else self.__materials
-    texture = materials.get(material, self.__checkerboard_array)
-    texture_width, texture_height = texture.shape
-
-    normalized_x = wall_x - math.floor(wall_x)
-    texture_x = max(0, min(texture_width-1, int(normalized_x * texture_width)))
-
-    if flip_texture:
-      texture_x = texture_width-1 - texture_x
-
-    indices = numpy.linspace(0, texture_height-1, num=height, dtype=numpy.uint32)
-    self.__buffer[x,y_start:y_end] = texture[indices,texture_x]
-
   def __draw_object(self, texture, position, camera):
     view_position = camera.to_view_position(position)
     distance = view_position.length()
@@ -305,14 +432,45 @@ class Renderer:
     if x_start == x_end or y_start == y_end:
       return
 
-    scaled_texture = pygame.transform.scale(texture, (width, height))
-
-    for i in range(x_end - x_start):
-      x = x_start + i
+    columns = x_start + numpy.nonzero(distance < self.__z_buffer[x_start:x_end])[0]
+    if columns.size == 0:
+      return
 
-      if distance < self.__z_buffer[x]:
-        self.__screen.blit(scaled_texture, (x, y_start), pygame.Rect(x_offset + i, 0, 1, height))
-        self.__z_buffer[x] = distance
+    (colors, alpha) = self.__get_sprite(texture, height)
+    sprite_size = colors.shape[0]
+    rows = min(height, self.__size.height - y_start)
+    texture_x = (columns - x_start + x_offset) * sprite_size // width
+    texture_y = numpy.arange(rows) * sprite_size // height
+
+    self.__composite(columns, y_start, colors[texture_x[:, numpy.newaxis], texture_y], alpha[texture_x[:, numpy.newaxis], texture_y])
+    self.__z_buffer[columns] = distance
+
+  def __get_sprite(self, texture, size):
+    quantized_size = max(1, -(-size // _SPRITE_SIZE_QUANTUM)) * _SPRITE_SIZE_QUANTUM
+    return self.__sprites.get((texture, quantized_size), lambda: self.__create_sprite(texture, quantized_size))
+
+  def __create_sprite(self, texture, size):
+    scaled = pygame.transform.scale(texture, (size, size))
+    colors = pygame.surfarray.array2d(scaled.convert(self.__screen))
+    alpha = pygame.surfarray.array_alpha(scaled) if scaled.get_flags() & pygame.SRCALPHA else numpy.full(colors.shape, 255, dtype=numpy.uint8)
+    return (colors.astype(numpy.uint32), alpha)
+
+  def __composite(self, columns, y_start, colors, alpha):
+    y_end = y_start + colors.shape[1]
+    destination = self.__buffer[columns, y_start:y_end]
+    blended = numpy.where(alpha == 255, colors, destination)
+
+    partial = (alpha > 0) & (alpha < 255)
+    if partial.any():
+      source, target, weight = colors[partial], destination[partial], alpha[partial].astype(numpy.uint32)
+      mixed = target & ~numpy.uint32(self.__color_mask)
+      for mask, shift in zip(self.__screen.get_masks()[:3], self.__screen.get_shifts()[:3]):
+        mask, shift = numpy.uint32(mask), numpy.uint32(shift)
+        channel = ((source & mask) >> shift) * weight + ((target & mask) >> shift) * (255 - weight)
+        mixed |= (channel // 255) << shift
+      blended[partial] = mixed
+
+    self.__buffer[columns, y_start:y_end] = blended
 
   def __draw_text(self, string, position, camera):
     view_position = camera.to_view_position(position)
@@ -327,17 +485,59 @@ class Renderer:
     if column < 0 or column >= self.__size.width:
       return
 
-    foreground = pygame.Color(255, 255, 255)
-    background = pygame.Color(50, 50, 50)
-
-    text = self.__font.render(string, 1, foreground, background)
+    scale = self.__get_label_scale(distance) if self.__scale_labels else 1
+    text = self.__get_label(string, _LABEL_FOREGROUND, _LABEL_BACKGROUND, scale)
     distance_in_front_of_other_objects = distance - 1e-3
 
     if distance_in_front_of_other_objects < self.__z_buffer[column]:
-      x = column - int(text.get_width() / 2)
-      half_height = int(self.__size.height / 2)
+      x = int(column * self.__window_size.width / self.__size.width) - int(text.get_width() / 2)
+      half_height = int(self.__window_size.height / 2)
       self.__screen.blit(text, (x, half_height))
       self.__z_buffer[column] = distance_in_front_of_other_objects
 
+  def __get_label_scale(self, distance):
+    scale = min(1, _LABEL_FULL_SIZE_DISTANCE / (distance + smallest_number))
+    return max(_LABEL_MIN_SCALE, math.ceil(scale / _LABEL_SCALE_QUANTUM) * _LABEL_SCALE_QUANTUM)
+
+  def __get_label(self, string, foreground, background, scale):
+    key = (string, foreground, background, self.__font.get_height(), scale)
+    return self.__labels.get(key, lambda: self.__create_label(string, foreground, background, scale))
+
+  def __create_label(self, string, foreground, background, scale):
+    if scale != 1:
+      text = self.__get_label(string, foreground, background, 1)
+      size = (max(1, int(text.get_width() * scale)), max(1, int(text.get_height() * scale)))
+      return pygame.transform.smoothscale(text, size)
+    return self.__font.render(string, 1, foreground, background).convert(self.__screen)
+
+_RENDER_SCALE_STEP = 0.125
+
+class ResolutionScaler:
+  def __init__(self, target_frame_time, minimum=0.25, maximum=1, smoothing=0.1, cooldown=15):
+    self.__target_frame_time = target_frame_time
+    self.__minimum, self.__maximum = min(minimum, maximum), maximum
+    self.__smoothing, self.__cooldown = smoothing, cooldown
+    self.__average_frame_time = target_frame_time
+    self.__frames_since_change = 0
+    self.scale = maximum
+
+  def update(self, frame_time):
+    self.__average_frame_time += self.__smoothing * (frame_time - self.__average_frame_time)
+    self.__frames_since_change += 1
+    if self.__frames_since_change < self.__cooldown:
+      return self.scale
+
+    if self.__average_frame_time > 1.1 * self.__target_frame_time:
+      scale = max(self.__minimum, self.scale - _RENDER_SCALE_STEP)
+    elif self.__average_frame_time < 0.7 * self.__target_frame_time:
+      scale = min(self.__maximum, self.scale + _RENDER_SCALE_STEP)
+    else:
+      scale = self.scale
+
+    if scale != self.scale:
+      self.scale = scale
+      self.__frames_since_change = 0
+    return self.scale
+
 def milliseconds_since_start():
   return pygame.time.get_ticks()
@@ -1,47 +1,81 @@
+import collections
 import enum
+import json
+import struct
+import time
 import traceback
 
 import zmq
 
-from domain import Direction, Map, Material, Object, Player, Position
+from domain import Direction, Input, InputAck, InterestGrid, Map, MapDelta, Material, Object, Player, PlayerInput, Position
+from metrics import NullMetrics
 
 NoneType = type(None)
 
+_MATERIAL_NAMES = [material.name for material in sorted(Material, key=lambda material: material.value)]
+_OBJECTS = tuple(sorted(Object, key=lambda object: object.value))
+
+_ListOf = collections.namedtuple('_ListOf', [ 'Type', ])
+
 _COMMAND_TYPES = {
   'activate': (str, NoneType),
   'get_world_map': (NoneType, Map),
+  'input': (PlayerInput, InputAck),
   'join': (str, Player),
   'leave': (str, NoneType),
   'move': (Player, NoneType),
 }
 
 _EVENT_TYPES = {
+  'map_delta': MapDelta,
   'player': Player,
   'player_left': str,
+  'keyframe': _ListOf(Player),
+  'players': _ListOf(Player),
   'world_map': Map,
 }
 
+_COMMAND_METRICS = { command_name: 'server.command.' + command_name for command_name in _COMMAND_TYPES }
+_EVENT_METRICS = { event_name: 'server.events.' + event_name for event_name in _EVENT_TYPES }
+
 def serialize(Type, v):
+  if isinstance(Type, _ListOf):
+    return [serialize(Type.Type, item) for item in v]
   assert isinstance(v, Type), "{} is not a {}".format(v, Type)
-  if Type in [float, int, NoneType, str]:
+  if Type in [bool, float, int, NoneType, str]:
     return v
   elif issubclass(Type, enum.Enum):
     return v.name
   elif Type in [Direction, Position]:
     return [serialize(float, v.x), serialize(float, v.y)]
   elif Type == Map:
-    return dict(materials=[serialize(Material, m) for m in v.materials],
+    return dict(materials=[_MATERIAL_NAMES[material_id] for material_id in v.cells],
                 objects=[[serialize(Object, o), serialize(Position, p)] for o, p in v.objects],
-                width=serialize(int, v.width))
+                width=serialize(int, v.width),
+                version=serialize(int, v.version))
+  elif Type == MapDelta:
+    return dict(version=serialize(int, v.version),
+                changes=[[serialize(int, p.x), serialize(int, p.y), serialize(Material, m)] for p, m in v.changes])
   elif Type == Player:
     return dict(name=serialize(str, v.name),
                 position=serialize(Position, v.position),
                 forward=serialize(Direction, v.forward))
+  elif Type == Input:
+    return { field: serialize(bool, value) for field, value in v._asdict().items() }
+  elif Type == PlayerInput:
+    return dict(name=serialize(str, v.name),
+                sequence=serialize(int, v.sequence),
+                input=serialize(Input, v.input))
+  elif Type == InputAck:
+    return dict(sequence=serialize(int, v.sequence),
+                player=serialize(Player, v.player))
   else:
     raise Exception("Cannot serialize object of type {}".format(Type))
 
 def deserialize(Type, v):
-  if Type in [float, int, NoneType, str]:
+  if isinstance(Type, _ListOf):
+    return [deserialize(Type.Type, item) for item in v]
+  elif Type in [bool, float, int, NoneType, str]:
     result = v
   elif issubclass(Type, enum.Enum):
     result = Type[v]
@@ -50,76 +84,516 @@ def deserialize(Type, v):
     result = Type(x=deserialize(float, x),
                   y=deserialize(float, y))
   elif Type == Map:
-    result = Map(materials=[deserialize(Material, m) for m in v['materials']],
+    result = Map(materials=bytes(Material[m].value for m in v['materials']),
                  objects=[(deserialize(Object, o), deserialize(Position, p)) for o, p in v['objects']],
-                 width=deserialize(int, v['width']))
+                 width=deserialize(int, v['width']),
+                 version=deserialize(int, v.get('version', 0)))
+  elif Type == MapDelta:
+    result = MapDelta(version=deserialize(int, v['version']),
+                      changes=[(Position(deserialize(int, x), deserialize(int, y)), deserialize(Material, m)) for x, y, m in v['changes']])
   elif Type == Player:
     result = Player(name=deserialize(str, v['name']),
                     position=deserialize(Position, v['position']),
                     forward=deserialize(Direction, v['forward']))
+  elif Type == Input:
+    result = Input(**{ field: deserialize(bool, v[field]) for field in Input._fields })
+  elif Type == PlayerInput:
+    result = PlayerInput(name=deserialize(str, v['name']),
+                         sequence=deserialize(int, v['sequence']),
+                         input=deserialize(Input, v['input']))
+  elif Type == InputAck:
+    result = InputAck(sequence=deserialize(int, v['sequence']),
+                      player=deserialize(Player, v['player']))
   else:
     raise Exception("Cannot deserialize object of type {}".format(Type))
   assert isinstance(result, Type), "{} is not a {}".format(v, Type)
   return result
 
+class JsonCodec:
+  name = 'json'
+
+  def encode(self, Type, v):
+    return json.dumps(serialize(Type, v)).encode('utf-8')
+
+  def decode(self, Type, data):
+    return deserialize(Type, json.loads(bytes(data).decode('utf-8')))
+
+_UINT8 = struct.Struct('<B')
+_UINT16 = struct.Struct('<H')
+_UINT32 = struct.Struct('<I')
+_INT64 = struct.Struct('<q')
+_FLOAT64 = struct.Struct('<d')
+_VECTOR = struct.Struct('<2d')
+_PLAYER = struct.Struct('<4d')
+_MAP_HEADER = struct.Struct('<III')
+_MAP_OBJECT = struct.Struct('<B2d')
+_MAP_DELTA_HEADER = struct.Struct('<II')
+_MAP_CHANGE = struct.Struct('<iiB')
+
+def _pack_struct(struct_):
+  def pack(v):
+    return struct_.pack(v)
+  def unpack(data, offset):
+    v, = struct_.unpack_from(data, offset)
+    return v, offset + struct_.size
+  return pack, unpack
+
+def _pack_none(v):
+  return b''
+
+def _unpack_none(data, offset):
+  return None, offset
+
+def _pack_string(v):
+  data = v.encode('utf-8')
+  return _UINT16.pack(len(data)) + data
+
+def _unpack_string(data, offset):
+  length, = _UINT16.unpack_from(data, offset)
+  offset += _UINT16.size
+  return bytes(data[offset:offset+length]).decode('utf-8'), offset + length
+
+def _pack_vector(v):
+  return _VECTOR.pack(v.x, v.y)
+
+def _unpack_vector(Type):
+  def unpack(data, offset):
+    x, y = _VECTOR.unpack_from(data, offset)
+    return Type(x, y), offset + _VECTOR.size
+  return unpack
+
+def _pack_player(v):
+  return _pack_string(v.name) + _PLAYER.pack(v.position.x, v.position.y, v.forward.x, v.forward.y)
+
+def _unpack_player(data, offset):
+  name, offset = _unpack_string(data, offset)
+  position_x, position_y, forward_x, forward_y = _PLAYER.unpack_from(data, offset)
+  return Player(name, Position(position_x, position_y), Direction(forward_x, forward_y)), offset + _PLAYER.size
+
+def _pack_input(v):
+  return _UINT8.pack(sum(1 << bit for bit, pressed in enumerate(v) if pressed))
+
+def _unpack_input(data, offset):
+  bits, = _UINT8.unpack_from(data, offset)
+  return Input(*(bool(bits & (1 << bit)) for bit in range(len(Input._fields)))), offset + _UINT8.size
+
+def _pack_player_input(v):
+  return _pack_string(v.name) + _UINT32.pack(v.sequence) + _pack_input(v.input)
+
+def _unpack_player_input(data, offset):
+  name, offset = _unpack_string(data, offset)
+  sequence, = _UINT32.unpack_from(data, offset)
+  input, offset = _unpack_input(data, offset + _UINT32.size)
+  return PlayerInput(name, sequence, input), offset
+
+def _pack_input_ack(v):
+  return _UINT32.pack(v.sequence) + _pack_player(v.player)
+
+def _unpack_input_ack(data, offset):
+  sequence, = _UINT32.unpack_from(data, offset)
+  player, offset = _unpack_player(data, offset + _UINT32.size)
+  return InputAck(sequence, player), offset
+
+def _pack_map(v):
+  parts = [_MAP_HEADER.pack(v.width, v.version, len(v.cells)), v.cells, _UINT32.pack(len(v.objects))]
+  parts.extend(_MAP_OBJECT.pack(o.value, p.x, p.y) for o, p in v.objects)
+  return b''.join(parts)
+
+def _unpack_map(data, offset):
+  width, version, cell_count = _MAP_HEADER.unpack_from(data, offset)
+  offset += _MAP_HEADER.size
+  cells = bytes(data[offset:offset+cell_count])
+  offset += cell_count
+  object_count, = _UINT32.unpack_from(data, offset)
+  offset += _UINT32.size
+  objects = []
+  for _ in range(object_count):
+    object_id, x, y = _MAP_OBJECT.unpack_from(data, offset)
+    offset += _MAP_OBJECT.size
+    objects.append((_OBJECTS[object_id], Position(x, y)))
+  return Map(cells, objects, width, version), offset
+
+def _pack_map_delta(v):
+  parts = [_MAP_DELTA_HEADER.pack(v.version, len(v.changes))]
+  parts.extend(_MAP_CHANGE.pack(p.x, p.y, m.value) for p, m in v.changes)
+  return b''.join(parts)
+
+def _unpack_map_delta(data, offset):
+  version, change_count = _MAP_DELTA_HEADER.unpack_from(data, offset)
+  offset += _MAP_DELTA_HEADER.size
+  changes = []
+  for _ in range(change_count):
+    x, y, material_id = _MAP_CHANGE.unpack_from(data, offset)
+    offset += _MAP_CHANGE.size
+    changes.append((Position(x, y), Material(material_id)))
+  return MapDelta(version, changes), offset
+
+class BinaryCodec:
+  name = 'binary'
+
+  __TYPES = {
+    NoneType: (_pack_none, _unpack_none),
+    int: _pack_struct(_INT64),
+    float: _pack_struct(_FLOAT64),
+    str: (_pack_string, _unpack_string),
+    Direction: (_pack_vector, _unpack_vector(Direction)),
+    Position: (_pack_vector, _unpack_vector(Position)),
+    Map: (_pack_map, _unpack_map),
+    MapDelta: (_pack_map_delta, _unpack_map_delta),
+    Player: (_pack_player, _unpack_player),
+    Input: (_pack_input, _unpack_input),
+    PlayerInput: (_pack_player_input, _unpack_player_input),
+    InputAck: (_pack_input_ack, _unpack_input_ack),
+  }
+
+  def encode(self, Type, v):
+    if isinstance(Type, _ListOf):
+      pack, _ = self.__TYPES[Type.Type]
+      return b''.join([_UINT32.pack(len(v))] + [pack(item) for item in v])
+    elif issubclass(Type, enum.Enum):
+      return _UINT8.pack(v.value)
+    pack, _ = self.__TYPES[Type]
+    return pack(v)
+
+  def decode(self, Type, data):
+    if isinstance(Type, _ListOf):
+      _, unpack = self.__TYPES[Type.Type]
+      count, = _UINT32.unpack_from(data)
+      offset = _UINT32.size
+      result = []
+      for _ in range(count):
+        item, offset = unpack(data, offset)
+        result.append(item)
+      return result
+    elif issubclass(Type, enum.Enum):
+      return Type(_UINT8.unpack_from(data)[0])
+    _, unpack = self.__TYPES[Type]
+    result, _ = unpack(data, 0)
+    return result
+
+_CODECS = { codec.name: codec for codec in [JsonCodec(), BinaryCodec()] }
+
+_COALESCED_COMMANDS = {'get_world_map', 'input', 'move'}
+_INTEREST_REGION_SIZE = 8
+_INTEREST_RADIUS = 1
+_MAX_EVENT_BACKLOG = 256
+_REPLY_TIMEOUT = 2.0
+_PLAYER_BATCHES = {'keyframe', 'players'}
+
+def _topic(codec_name, region=None):
+  if region is None:
+    return '{}/*'.format(codec_name).encode()
+  return '{}/{},{};'.format(codec_name, *region).encode()
+
+def _keep_latest(items, key_fn):
+  latest = {}
+  for index, item in enumerate(items):
+    key = key_fn(*item)
+    if key is not None:
+      latest[key] = index
+  return [item for index, item in enumerate(items) if latest.get(key_fn(*item), index) == index]
+
+def _drop_superseded_frames(frames):
+  keyframes = {}
+  for index, (topic, event_name, _) in enumerate(frames):
+    if event_name == 'keyframe':
+      keyframes[topic] = index
+  return [frame for index, frame in enumerate(frames) if frame[1] not in _PLAYER_BATCHES or index >= keyframes.get(frame[0], index)]
+
+def _event_key(event_name, event_data):
+  if event_name == 'player':
+    return 'player', event_data.name
+  elif event_name == 'player_left':
+    return 'player', event_data
+  return None
+
+def coalesce_events(events):
+  return _keep_latest(events, _event_key)
+
 class ServerConnection:
-  def __init__(self, host, port):
+  def __init__(self, host, port, codecs=('binary', 'json'), interest_region_size=_INTEREST_REGION_SIZE, metrics=NullMetrics(), timeout=None):
     self.__context = zmq.Context()
-    self.__commands = self.__context.socket(zmq.REQ)
+    self.__commands = self.__context.socket(zmq.DEALER)
+    if timeout is not None:
+      self.__commands.setsockopt(zmq.RCVTIMEO, int(timeout * 1000))
     self.__commands.connect("tcp://{}:{}".format(host, port))
     self.__events = self.__context.socket(zmq.SUB)
     self.__events.connect("tcp://{}:{}".format(host, port + 1))
-    self.__events.setsockopt_string(zmq.SUBSCRIBE, "")
+    self.__offered_codecs = ','.join(codecs).encode()
+    self.__codec = _CODECS['json']
+    self.__next_request_id = 0
+    self.__in_flight = {}
+    self.__pending = []
+    self.__replies = collections.deque()
+    self.__interest = InterestGrid(interest_region_size)
+    self.__regions = set()
+    self.__backlog = []
+    self.__metrics = metrics
+
+  def __send_request(self, command_name, input_data):
+    InputType, _ = _COMMAND_TYPES[command_name]
+    request_id = _UINT32.pack(self.__next_request_id)
+    self.__next_request_id = (self.__next_request_id + 1) % (1 << 32)
+    frames = [b'', request_id, self.__codec.name.encode(), command_name.encode(), self.__codec.encode(InputType, input_data)]
+    if command_name == 'join':
+      frames.append(self.__offered_codecs)
+    self.__commands.send_multipart(frames)
+    self.__in_flight[request_id] = command_name, time.perf_counter()
+    return request_id
+
+  def __receive_reply(self, flags=0):
+    _, request_id, status, *rest = self.__commands.recv_multipart(flags=flags)
+    if request_id not in self.__in_flight:
+      return request_id, None, None
+    command_name, _ = self.__in_flight.pop(request_id)
+    _, OutputType = _COMMAND_TYPES[command_name]
+    assert status == b'1', "Command {} failed".format(command_name)
+    output_data = self.__codec.decode(OutputType, rest[0])
+    if command_name == 'join':
+      self.__use_codec(rest[1].decode())
+    return request_id, command_name, output_data
 
   def call(self, command_name, input_data=None):
-    InputType, OutputType = _COMMAND_TYPES[command_name]
-    input_json = {'command': command_name,
-                  'input': serialize(InputType, input_data)}
-    self.__commands.send_json(input_json)
-    output_json = self.__commands.recv_json()
-    assert output_json['success']
-    output_data = deserialize(OutputType, output_json['output'])
-    return output_data
-
-  def poll_events(self):
+    request_id = self.__send_request(command_name, input_data)
     while True:
+      reply_id, reply_command_name, output_data = self.__receive_reply()
+      if reply_id == request_id:
+        return output_data
+      if reply_command_name is not None:
+        self.__replies.append((reply_command_name, output_data))
+
+  def close(self):
+    self.__commands.close(linger=0)
+    self.__events.close(linger=0)
+    self.__context.term()
+
+  def send(self, command_name, input_data=None):
+    if self.__pending and self.__pending[-1][0] == command_name and command_name in _COALESCED_COMMANDS:
+      self.__pending[-1] = (command_name, input_data)
+    else:
+      self.__pending.append((command_name, input_data))
+
+  def __expire_replies(self):
+    expired = [request_id for request_id, (_, sent_time) in self.__in_flight.items() if time.perf_counter() - sent_time > _REPLY_TIMEOUT]
+    for request_id in expired:
+      del self.__in_flight[request_id]
+    self.__metrics.count('client.replies_expired', len(expired))
+
+  def flush(self):
+    self.__expire_replies()
+    in_flight = set(command_name for command_name, _ in self.__in_flight.values())
+    sent = 0
+    for command_name, input_data in self.__pending:
+      if command_name in _COALESCED_COMMANDS and command_name in in_flight:
+        break
+      self.__send_request(command_name, input_data)
+      in_flight.add(command_name)
+      sent += 1
+    del self.__pending[:sent]
+
+  def poll_replies(self):
+    while self.__replies:
+      yield self.__replies.popleft()
+    while self.__in_flight:
       try:
-        event_json = self.__events.recv_json(flags=zmq.NOBLOCK)
-        event_name = event_json['event']
-        EventType = _EVENT_TYPES[event_name]
-        event_data = deserialize(EventType, event_json['data'])
-        yield event_name, event_data
+        _, command_name, output_data = self.__receive_reply(flags=zmq.NOBLOCK)
+        if command_name is not None:
+          yield command_name, output_data
       except zmq.ZMQError as e:
         if e.errno == zmq.EAGAIN:
           break
         else:
           raise
 
+  def __use_codec(self, codec_name):
+    self.__set_subscriptions(set())
+    self.__backlog = []
+    self.__codec = _CODECS[codec_name]
+    self.__events.setsockopt(zmq.SUBSCRIBE, _topic(self.__codec.name))
+
+  def __set_subscriptions(self, regions):
+    for region in self.__regions - regions:
+      self.__events.setsockopt(zmq.UNSUBSCRIBE, _topic(self.__codec.name, region))
+    for region in regions - self.__regions:
+      self.__events.setsockopt(zmq.SUBSCRIBE, _topic(self.__codec.name, region))
+    self.__regions = regions
+
+  def update_interest(self, position):
+    self.__set_subscriptions(set(self.__interest.regions_near(position, _INTEREST_RADIUS)))
+
+  def __receive_events(self):
+    frames = []
+    while True:
+      try:
+        topic, event_name, data = self.__events.recv_multipart(flags=zmq.NOBLOCK)
+        frames.append((topic, event_name.decode(), data))
+      except zmq.ZMQError as e:
+        if e.errno == zmq.EAGAIN:
+          return frames
+        else:
+          raise
+
+  def poll_events(self, budget=None):
+    deadline = None if budget is None else time.perf_counter() + budget
+    received = self.__receive_events()
+    frames = _drop_superseded_frames(self.__backlog + received)
+    self.__metrics.add('client.events_per_poll', len(received))
+    self.__metrics.count('client.events_coalesced', len(self.__backlog) + len(received) - len(frames))
+    self.__metrics.count('client.events_dropped', max(len(frames) - _MAX_EVENT_BACKLOG, 0))
+    frames = frames[-_MAX_EVENT_BACKLOG:]
+
+    events = []
+    decoded = 0
+    for _, event_name, data in frames:
+      if decoded and deadline is not None and time.perf_counter() >= deadline:
+        break
+      with self.__metrics.time('client.decode'):
+        event_data = self.__codec.decode(_EVENT_TYPES[event_name], data)
+      decoded += 1
+      if event_name in _PLAYER_BATCHES:
+        events.extend(('player', player) for player in event_data)
+      else:
+        events.append((event_name, event_data))
+    self.__backlog = frames[decoded:]
+    return coalesce_events(events)
+
+_MAX_COMMANDS_PER_POLL = 1000
+
 class Server:
-  def __init__(self, port):
+  def __init__(self, port, codecs=('binary', 'json'), tick_rate=20, keyframe_interval=1.0, interest_region_size=_INTEREST_REGION_SIZE, metrics=NullMetrics()):
     self.__context = zmq.Context()
-    self.__commands = self.__context.socket(zmq.REP)
+    self.__commands = self.__context.socket(zmq.ROUTER)
     self.__commands.bind("tcp://*:{}".format(port))
     self.__events = self.__context.socket(zmq.PUB)
     self.__events.bind("tcp://*:{}".format(port + 1))
+    self.__codecs = codecs
+    self.__client_codecs = {}
+    self.__event_codecs = []
+    self.__tick_interval = 1 / tick_rate
+    self.__keyframe_interval = keyframe_interval
+    self.__pending_events = []
+    self.__pending_players = collections.OrderedDict()
+    self.__players = {}
+    self.__interest = InterestGrid(interest_region_size)
+    self.__metrics = metrics
+
+  def __negotiate(self, offered_codecs):
+    offered = offered_codecs.decode().split(',')
+    return next((name for name in offered if name in self.__codecs), 'json')
+
+  def __set_client_codec(self, name, codec_name):
+    if codec_name is None:
+      self.__client_codecs.pop(name, None)
+    else:
+      self.__client_codecs[name] = codec_name
+    self.__event_codecs = list(collections.OrderedDict.fromkeys(self.__client_codecs.values()))
 
-  def serve(self, command_fn):
+  def serve(self, command_fn, tick_fn=None, after_tick_fn=None):
+    poller = zmq.Poller()
+    poller.register(self.__commands, zmq.POLLIN)
+    next_tick = time.monotonic() + self.__tick_interval
+    next_keyframe = time.monotonic() + self.__keyframe_interval
     while True:
-      input_json = self.__commands.recv_json()
-      command_name = input_json['command']
-      InputType, OutputType = _COMMAND_TYPES[command_name]
-      input_data = deserialize(InputType, input_json['input'])
+      timeout = max(0, next_tick - time.monotonic())
+      if poller.poll(timeout * 1000):
+        self.__handle_commands(command_fn)
+      now = time.monotonic()
+      if now >= next_tick:
+        if tick_fn:
+          with self.__metrics.time('server.tick'):
+            tick_fn(self.__tick_interval)
+        with self.__metrics.time('server.publish'):
+          self.__publish_events()
+        if after_tick_fn:
+          after_tick_fn()
+        next_tick = max(next_tick + self.__tick_interval, now)
+      if now >= next_keyframe:
+        with self.__metrics.time('server.keyframe'):
+          self.__publish_keyframe()
+        next_keyframe = max(next_keyframe + self.__keyframe_interval, now)
+
+  def __handle_commands(self, command_fn):
+    handled = 0
+    for _ in range(_MAX_COMMANDS_PER_POLL):
       try:
+        frames = self.__commands.recv_multipart(flags=zmq.NOBLOCK)
+      except zmq.ZMQError as e:
+        if e.errno == zmq.EAGAIN:
+          break
+        else:
+          raise
+      self.__handle_command(command_fn, frames)
+      handled += 1
+    self.__metrics.add('server.commands_per_poll', handled)
+
+  def __handle_command(self, command_fn, frames):
+    envelope, request_id, codec_name, command_name, data = frames[:2], frames[2], frames[3].decode(), frames[4].decode(), frames[5]
+    codec = _CODECS[codec_name]
+    InputType, OutputType = _COMMAND_TYPES[command_name]
+    with self.__metrics.time('server.decode'):
+      input_data = codec.decode(InputType, data)
+    try:
+      with self.__metrics.time(_COMMAND_METRICS[command_name]):
         output_data = command_fn(command_name, input_data)
-        output_json = {'success': True,
-                       'output': serialize(OutputType, output_data)}
-      except:
-        traceback.print_exc()
-        output_json = {'success': False}
-      self.__commands.send_json(output_json)
+      with self.__metrics.time('server.encode'):
+        reply = envelope + [request_id, b'1', codec.encode(OutputType, output_data)]
+      succeeded = True
+    except:
+      traceback.print_exc()
+      self.__metrics.count('server.command_failures')
+      reply = envelope + [request_id, b'0', b'']
+      succeeded = False
+    if len(frames) > 6:
+      event_codec_name = self.__negotiate(frames[6])
+      if command_name == 'join' and succeeded:
+        self.__set_client_codec(input_data, event_codec_name)
+      reply.append(event_codec_name.encode())
+    self.__commands.send_multipart(reply)
 
   def emit_event(self, event_name, event_data):
+    if event_name == 'player':
+      self.__pending_players[event_data.name] = event_data
+    else:
+      if event_name == 'player_left':
+        self.__pending_players.pop(event_data, None)
+      self.__pending_events.append((event_name, event_data))
+
+  def __publish_events(self):
+    for event_name, event_data in self.__pending_events:
+      if event_name == 'player_left':
+        self.__players.pop(event_data, None)
+        self.__interest.remove(event_data)
+        self.__set_client_codec(event_data, None)
+      self.__publish(event_name, event_data)
+
+    players_by_region = collections.defaultdict(list)
+    for player in self.__pending_players.values():
+      previous_region = self.__interest.update(player.name, player.position)
+      region = self.__interest.region_of(player.name)
+      players_by_region[region].append(player)
+      if previous_region is not None and previous_region != region:
+        players_by_region[previous_region].append(player)
+      self.__players[player.name] = player
+    for region, players in players_by_region.items():
+      self.__publish('players', players, region)
+
+    self.__metrics.add('server.messages_per_tick', (len(self.__pending_events) + len(players_by_region)) * len(self.__event_codecs))
+    self.__pending_events = []
+    self.__pending_players.clear()
+
+  def __publish_keyframe(self):
+    players_by_region = collections.defaultdict(list)
+    for player in self.__players.values():
+      players_by_region[self.__interest.region_of(player.name)].append(player)
+    for region, players in players_by_region.items():
+      self.__publish('keyframe', players, region)
+
+  def __publish(self, event_name, event_data, region=None):
     EventType = _EVENT_TYPES[event_name]
-    event_json = {'event': event_name,
-                  'data': serialize(EventType, event_data)}
-    self.__events.send_json(event_json)
+    for codec_name in self.__event_codecs:
+      codec = _CODECS[codec_name]
+      with self.__metrics.time('server.encode'):
+        data = codec.encode(EventType, event_data)
+      self.__events.send_multipart([_topic(codec_name, region), event_name.encode(), data])
+      self.__metrics.add('server.event_bytes', len(data))
+    self.__metrics.count(_EVENT_METRICS[event_name])
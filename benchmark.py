@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+import argparse
+import collections
+import json
+import math
+import os
+import os.path
+import sys
+import time
+import tracemalloc
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+from adapter_multiprocessing import ParallelRaycaster
+from adapter_pygame import Color, load_color_scheme, load_font, load_image, load_images_for_enum, load_map, load_player_spawn, Renderer
+from domain import Angle, Direction, initial_input, Material, Object, Player, Position
+from metrics import Metrics
+from use_case import move_player, rotate_player
+
+_FRAME_TIME = 1 / 60
+_STAGES = [ 'renderer.raycast', 'renderer.draw_column', 'renderer.draw_object', 'renderer.blit', 'renderer.draw_text', 'renderer.flip', ]
+
+def _spin_path(world_map, spawn, frames):
+  for frame in range(frames):
+    forward = spawn.forward.rotate(Angle.from_radians(2 * math.pi * frame / frames))
+    yield spawn._replace(forward=forward), []
+
+def _walk_path(world_map, spawn, frames):
+  player = spawn
+  walking = initial_input._replace(forward=True)
+  turning = initial_input._replace(turn_right=True)
+  for _ in range(frames):
+    moved = move_player(player, world_map, walking, _FRAME_TIME, speed=5)
+    player = moved if moved != player else rotate_player(player, turning, _FRAME_TIME * 10, speed=3)
+    yield player, []
+
+def _crowd_path(world_map, spawn, frames):
+  crowd = []
+  for i in range(16):
+    angle = Angle.from_radians(2 * math.pi * i / 16)
+    offset = Direction(1.5 + (i % 4), 0.0).rotate(angle)
+    crowd.append(Player('player{}'.format(i), spawn.position + offset, spawn.forward))
+  for player, _ in _spin_path(world_map, spawn, frames):
+    yield player, crowd
+
+_PATHS = {
+  'spin': _spin_path,
+  'walk': _walk_path,
+  'crowd': _crowd_path,
+}
+
+def _create_renderer(root, size, render_scale, raycaster, metrics):
+  return Renderer(
+    window_size=size,
+    materials=load_images_for_enum(os.path.join(root, 'material'), Material),
+    objects=load_images_for_enum(os.path.join(root, 'object'), Object),
+    player_texture=load_image(os.path.join(root, 'player.png')),
+    font=load_font(os.path.join(root, 'font', 'league_mono', 'LeagueMono-Light.otf'), size=18),
+    field_of_view=Angle.from_degrees(66),
+    draw_distance=100,
+    far_color=Color(red=0, green=0, blue=0),
+    shade_scale=0.85,
+    object_scale=0.75,
+    render_scale=render_scale,
+    raycaster=raycaster,
+    metrics=metrics
+  )
+
+def _measure_allocations(renderer, color_scheme, world_map, frames):
+  peaks, blocks = [], []
+  tracemalloc.start()
+  for player, other_players in frames:
+    tracemalloc.clear_traces()
+    renderer.draw(color_scheme, world_map, player, other_players)
+    peaks.append(tracemalloc.get_traced_memory()[1])
+    blocks.append(len(tracemalloc.take_snapshot().traces))
+  tracemalloc.stop()
+  return max(peaks), sum(blocks) / len(blocks)
+
+def _run(root, map_path, path_name, args):
+  metrics = Metrics()
+  raycaster = ParallelRaycaster(args.processes) if args.processes else None
+  renderer = _create_renderer(root, args.size, args.render_scale, raycaster, metrics)
+  color_scheme = load_color_scheme(map_path)
+  world_map = load_map(map_path)
+  spawn = load_player_spawn(map_path)
+  frames = list(_PATHS[path_name](world_map, spawn, args.frames))
+
+  for player, other_players in frames[:args.warmup]:
+    renderer.draw(color_scheme, world_map, player, other_players)
+  metrics.histograms.clear()
+
+  start = time.perf_counter()
+  for player, other_players in frames:
+    with metrics.time('frame'):
+      renderer.draw(color_scheme, world_map, player, other_players)
+  elapsed = time.perf_counter() - start
+
+  frame = metrics.histogram('frame')
+  result = dict(
+    map=map_path,
+    path=path_name,
+    frames=len(frames),
+    fps=len(frames) / elapsed,
+    frame_ms=dict(mean=frame.mean()*1000, p50=frame.percentile(50)*1000, p95=frame.percentile(95)*1000, p99=frame.percentile(99)*1000, max=frame.maximum*1000),
+    stages_ms=collections.OrderedDict((stage, dict(mean=metrics.histogram(stage).mean()*1000, p99=metrics.histogram(stage).percentile(99)*1000)) for stage in _STAGES)
+  )
+
+  peak_bytes, live_blocks = _measure_allocations(renderer, color_scheme, world_map, frames[:args.allocation_frames])
+  result.update(peak_allocated_kib=peak_bytes / 1024, live_blocks_per_frame=live_blocks)
+  if raycaster:
+    raycaster.close()
+  return result
+
+def _print_result(result):
+  frame_ms = result['frame_ms']
+  print('{map} / {path}: {frames} frames, {fps:.1f} fps'.format(**result))
+  print('  frame ms   mean {mean:7.2f}  p50 {p50:7.2f}  p95 {p95:7.2f}  p99 {p99:7.2f}  max {max:7.2f}'.format(**frame_ms))
+  for stage, timing in result['stages_ms'].items():
+    print('  {:<22} mean {mean:7.2f}  p99 {p99:7.2f}'.format(stage, **timing))
+  print('  allocations: peak {peak_allocated_kib:.1f} KiB, {live_blocks_per_frame:.0f} live blocks per frame'.format(**result))
+
+def _parse_size(string):
+  width, height = string.lower().split('x')
+  return (int(width), int(height))
+
+def main(args):
+  root = os.path.dirname(os.path.realpath(__file__))
+  map_paths = args.map or [os.path.join(root, 'map')]
+
+  results = []
+  for map_path in map_paths:
+    for path_name in args.path or sorted(_PATHS):
+      result = _run(root, map_path, path_name, args)
+      _print_result(result)
+      results.append(result)
+
+  if args.json:
+    with open(args.json, 'w') as file:
+      json.dump(results, file, indent=2)
+
+  slow = [result for result in results if args.max_p99_ms and result['frame_ms']['p99'] > args.max_p99_ms]
+  for result in slow:
+    print('{map} / {path}: p99 frame time {:.2f} ms exceeds {:.2f} ms'.format(result['frame_ms']['p99'], args.max_p99_ms, **result), file=sys.stderr)
+
+  return 1 if slow else 0
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--map", action="append", help="map directory, may be repeated (default: map)")
+  parser.add_argument("--path", action="append", choices=sorted(_PATHS), help="camera path, may be repeated (default: all)")
+  parser.add_argument("--frames", type=int, default=240)
+  parser.add_argument("--warmup", type=int, default=10)
+  parser.add_argument("--allocation-frames", type=int, default=10)
+  parser.add_argument("--size", type=_parse_size, default=(640, 480))
+  parser.add_argument("--render-scale", type=float, default=1)
+  parser.add_argument("--processes", type=int, default=0, help="raycast on this many worker processes (default: in the main process)")
+  parser.add_argument("--json", help="also write the results to this file")
+  parser.add_argument("--max-p99-ms", type=float, help="exit with status 1 if any p99 frame time is above this")
+  args = parser.parse_args()
+  sys.exit(main(args))
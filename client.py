@@ -5,17 +5,28 @@ from getpass import getuser
 import os.path
 import sys
 
-from adapter_pygame import Color, milliseconds_since_start, load_color_scheme, load_font, load_image, load_map, load_player_spawn, load_images_for_enum, process_input, Renderer
+from adapter_pygame import Color, milliseconds_since_start, load_color_scheme, load_font, load_image, load_map, load_player_spawn, load_images_for_enum, process_input, Renderer, ResolutionScaler
+from adapter_multiprocessing import ParallelRaycaster
 from adapter_zmq import ServerConnection
 from domain import Angle, Direction, initial_input, Map, Material, Player, Position, Object
-from use_case import initial_state, handle_event
+from metrics import Metrics, NullMetrics, PeriodicDump
+from use_case import initial_state, handle_event, interpolate_players
+
+_REPLY_EVENTS = {
+  'get_world_map': 'world_map',
+  'input': 'input_ack',
+}
 
 def main(args):
   root = os.path.dirname(os.path.realpath(__file__))
   map_path = os.path.join(root, 'map')
 
+  metrics = Metrics() if args.stats_interval else NullMetrics()
+  stats_file = open(args.stats_file, 'a') if args.stats_interval and args.stats_file else None
+  stats = PeriodicDump(metrics, stats_file or sys.stderr, args.stats_interval) if args.stats_interval else None
+
   if args.connect:
-    server = ServerConnection(args.connect, args.port)
+    server = ServerConnection(args.connect, args.port, codecs=(args.codec, 'json'), metrics=metrics)
     player = server.call("join", getuser())
     world_map = server.call("get_world_map")
   else:
@@ -29,6 +40,7 @@ def main(args):
   player_texture = load_image(os.path.join(root, 'player.png'))
   font = load_font(os.path.join(root, 'font', 'league_mono', 'LeagueMono-Light.otf'), size=18)
 
+  raycaster = ParallelRaycaster(args.render_processes) if args.render_processes else None
   renderer = Renderer(
     window_size=(640, 480),
     materials=materials,
@@ -39,8 +51,12 @@ def main(args):
     draw_distance=100,
     far_color=Color(red=0, green=0, blue=0),
     shade_scale=0.85,
-    object_scale=0.75
+    object_scale=0.75,
+    render_scale=args.render_scale,
+    raycaster=raycaster,
+    metrics=metrics
   )
+  scaler = ResolutionScaler(1 / args.target_fps, maximum=args.render_scale) if args.target_fps else None
 
   max_frame_time = 50
   rotation_speed = 3
@@ -48,32 +64,47 @@ def main(args):
 
   time = milliseconds_since_start()
   input = initial_input
-  state = initial_state(input, player, world_map, rotation_speed, movement_speed)
+  state = initial_state(input, player, world_map, rotation_speed, movement_speed, authoritative=args.authoritative)
   running = True
 
-  def interact(command_name, command_data):
+  def interact(event_name, event_data):
     nonlocal state
-    state, commands = handle_event(state, command_name, command_data)
+    state, commands = handle_event(state, event_name, event_data)
     if server:
       for command_name, command_input in commands:
-        server.call(command_name, command_input)
+        server.send(command_name, command_input)
 
   while running:
     if server:
-      for event_name, event_data in server.poll_events():
-        state, commands = handle_event(state, event_name, event_data)
-        for command_name, command_input in commands:
-          server.call(command_name, command_input)
+      for command_name, output_data in server.poll_replies():
+        if command_name in _REPLY_EVENTS:
+          interact(_REPLY_EVENTS[command_name], output_data)
+      for event_name, event_data in server.poll_events(budget=args.event_budget / 1000):
+        interact(event_name, event_data)
 
     last_time = time
     time = milliseconds_since_start()
     frame_time = min(time - last_time, max_frame_time) / 1000
+    metrics.add('client.frame', (time - last_time) / 1000)
+    if stats:
+      stats.update()
+    if scaler:
+      renderer.set_render_scale(scaler.update((time - last_time) / 1000))
 
     (input, running) = process_input(previous_input=input)
     interact('input', input)
     interact('tick', frame_time)
-    renderer.draw(color_scheme, state.world_map, state.player, state.other_players.values())
+    if server:
+      server.update_interest(state.player.position)
+      server.flush()
+    renderer.draw(color_scheme, state.world_map, state.player, interpolate_players(state))
   interact('exit', None)
+  if raycaster:
+    raycaster.close()
+  if stats:
+    stats.dump()
+  if stats_file:
+    stats_file.close()
 
   return 0
 
@@ -81,5 +112,13 @@ if __name__ == '__main__':
   parser = argparse.ArgumentParser()
   parser.add_argument("--connect")
   parser.add_argument("--port", type=int, default=12345)
+  parser.add_argument("--codec", choices=["binary", "json"], default="binary")
+  parser.add_argument("--render-scale", type=float, default=1)
+  parser.add_argument("--target-fps", type=float)
+  parser.add_argument("--render-processes", type=int, default=0)
+  parser.add_argument("--authoritative", action="store_true")
+  parser.add_argument("--event-budget", type=float, default=4, help="milliseconds per frame to spend decoding server events")
+  parser.add_argument("--stats-interval", type=float, help="write timings and counters as a JSON line this often, in seconds")
+  parser.add_argument("--stats-file", help="append the stats to this file (default: stderr)")
   args = parser.parse_args()
   sys.exit(main(args))
@@ -1,6 +1,7 @@
 import collections
 import enum
 import math
+import numpy
 import sys
 
 smallest_number = sys.float_info.epsilon
@@ -23,46 +24,149 @@ class Angle:
   def to_degrees(self):
     return (180 * self.__radians) / math.pi
 
+  def cos_sin(self):
+    return (math.cos(self.__radians), math.sin(self.__radians))
+
+_new_tuple = tuple.__new__
+
 class _Vector(collections.namedtuple('_Vector', 'x, y')):
+  __slots__ = ()
+
   def __add__(self, v):
-    return _Vector(self.x + v.x, self.y + v.y)
+    x, y = self
+    vx, vy = v
+    return _new_tuple(_Vector, (x + vx, y + vy))
 
   def __sub__(self, v):
-    return _Vector(self.x - v.x, self.y - v.y)
+    x, y = self
+    vx, vy = v
+    return _new_tuple(_Vector, (x - vx, y - vy))
 
   def __mul__(self, s):
-    return _Vector(self.x * s, self.y * s)
+    x, y = self
+    return _new_tuple(_Vector, (x * s, y * s))
 
   def __div__(self, s):
-    return _Vector(self.x / s, self.y / s)
+    x, y = self
+    return _new_tuple(_Vector, (x / s, y / s))
 
   def length(self):
-    return math.sqrt(self.x*self.x + self.y*self.y)
+    x, y = self
+    return math.sqrt(x*x + y*y)
 
-  def normalize(self):
-    return self * (1 / (self.length() + smallest_number))
+  def normalize(self, length=1):
+    x, y = self
+    scale = length / (math.sqrt(x*x + y*y) + smallest_number)
+    return _new_tuple(_Vector, (x * scale, y * scale))
 
   def abs(self):
-    return _Vector(abs(self.x), abs(self.y))
+    x, y = self
+    return _new_tuple(_Vector, (abs(x), abs(y)))
 
   def to_grid(self):
-    return _Vector(int(math.floor(self.x)), int(math.floor(self.y)))
+    x, y = self
+    return _new_tuple(_Vector, (int(math.floor(x)), int(math.floor(y))))
 
   def dot(self, v):
-    return self.x*v.x + self.y*v.y
+    x, y = self
+    vx, vy = v
+    return x*vx + y*vy
 
   def rotate(self, angle):
-    radians = angle.to_radians()
-    x = self.x * math.cos(radians) - self.y * math.sin(radians)
-    y = self.x * math.sin(radians) + self.y * math.cos(radians)
-    return _Vector(x, y)
+    return self.rotate_by(*angle.cos_sin())
+
+  def rotate_by(self, cos, sin):
+    x, y = self
+    return _new_tuple(_Vector, (x * cos - y * sin, x * sin + y * cos))
 
 Direction = _Vector
 Position = _Vector
 
 LineSegment = collections.namedtuple('LineSegment', [ 'start', 'end', ])
 Input = collections.namedtuple('Input', [ 'forward', 'backward', 'turn_left', 'turn_right', 'activate', ])
-Player = collections.namedtuple('Player', [ 'name', 'position', 'forward', ])
+_KEEP = object()
+
+class Player(collections.namedtuple('Player', [ 'name', 'position', 'forward', ])):
+  __slots__ = ()
+
+  def _replace(self, name=_KEEP, position=_KEEP, forward=_KEEP):
+    return _new_tuple(Player, (self.name if name is _KEEP else name,
+                               self.position if position is _KEEP else position,
+                               self.forward if forward is _KEEP else forward))
+PlayerInput = collections.namedtuple('PlayerInput', [ 'name', 'sequence', 'input', ])
+InputAck = collections.namedtuple('InputAck', [ 'sequence', 'player', ])
+
+class PlayerTable:
+  def __init__(self, players=(), capacity=16):
+    self.__names = []
+    self.__indices = {}
+    self.__positions = numpy.zeros((capacity, 2), dtype=numpy.float64)
+    self.__forwards = numpy.zeros((capacity, 2), dtype=numpy.float64)
+    for player in players:
+      self[player.name] = player
+
+  @property
+  def names(self):
+    return self.__names
+
+  @property
+  def positions(self):
+    return self.__positions[:len(self.__names)]
+
+  @property
+  def forwards(self):
+    return self.__forwards[:len(self.__names)]
+
+  def index(self, name):
+    return self.__indices[name]
+
+  def __len__(self):
+    return len(self.__names)
+
+  def __contains__(self, name):
+    return name in self.__indices
+
+  def __iter__(self):
+    return iter(self.__names)
+
+  def __getitem__(self, name):
+    return self.__player(self.__indices[name])
+
+  def __setitem__(self, name, player):
+    if name not in self.__indices:
+      if len(self.__names) == len(self.__positions):
+        self.__positions = numpy.concatenate((self.__positions, numpy.zeros_like(self.__positions)))
+        self.__forwards = numpy.concatenate((self.__forwards, numpy.zeros_like(self.__forwards)))
+      self.__indices[name] = len(self.__names)
+      self.__names.append(name)
+    index = self.__indices[name]
+    self.__positions[index] = player.position
+    self.__forwards[index] = player.forward
+
+  def pop(self, name, *default):
+    if name not in self.__indices:
+      if default:
+        return default[0]
+      raise KeyError(name)
+    index, last = self.__indices.pop(name), len(self.__names) - 1
+    player = self.__player(index)
+    if index != last:
+      self.__names[index] = self.__names[last]
+      self.__indices[self.__names[index]] = index
+      self.__positions[index], self.__forwards[index] = self.__positions[last], self.__forwards[last]
+    self.__names.pop()
+    return player
+
+  def values(self):
+    return [self.__player(index) for index in range(len(self.__names))]
+
+  def players(self, indices):
+    positions, forwards = self.__positions[indices].tolist(), self.__forwards[indices].tolist()
+    return [Player(self.__names[index], _new_tuple(_Vector, position), _new_tuple(_Vector, forward)) for index, position, forward in zip(indices, positions, forwards)]
+
+  def __player(self, index):
+    position, forward = self.__positions[index].tolist(), self.__forwards[index].tolist()
+    return Player(self.__names[index], _new_tuple(_Vector, position), _new_tuple(_Vector, forward))
 
 initial_input = Input(
   forward=False,
@@ -93,20 +197,229 @@ class Object(enum.Enum):
   COMPUTER = 4
   PLANT = 5
 
-class Map(collections.namedtuple('Map', 'materials, objects, width')):
+_MATERIALS = tuple(sorted(Material, key=lambda material: material.value))
+_FLOOR_ID, _VOID_ID = Material.FLOOR.value, Material.VOID.value
+
+def _to_cells(materials):
+  if isinstance(materials, bytes):
+    return materials
+  elif isinstance(materials, numpy.ndarray):
+    return materials.astype(numpy.uint8).tobytes()
+  else:
+    return bytes(material.value for material in materials)
+
+_MAX_CLEARANCE = 8
+
+def _compute_clearance(floor):
+  clearance = numpy.zeros(floor.shape, dtype=numpy.uint8)
+  level = floor
+  for _ in range(_MAX_CLEARANCE):
+    clearance += level
+    padded = numpy.pad(level, 1, mode='constant', constant_values=False)
+    height, width = level.shape
+    level = numpy.logical_and.reduce([padded[dy:dy+height, dx:dx+width] for dy in range(3) for dx in range(3)])
+  return clearance
+
+def _update_clearance(clearance, grid, x, y):
+  height, width = grid.shape
+  window_x, window_y = slice(max(0, x - 2*_MAX_CLEARANCE), x + 2*_MAX_CLEARANCE + 1), slice(max(0, y - 2*_MAX_CLEARANCE), y + 2*_MAX_CLEARANCE + 1)
+  window = _compute_clearance(grid[window_y, window_x] == _FLOOR_ID)
+  affected_x, affected_y = slice(max(0, x - _MAX_CLEARANCE), x + _MAX_CLEARANCE + 1), slice(max(0, y - _MAX_CLEARANCE), y + _MAX_CLEARANCE + 1)
+  new_clearance = clearance.copy()
+  new_clearance[affected_y, affected_x] = window[affected_y.start - window_y.start:affected_y.stop - window_y.start,
+                                                 affected_x.start - window_x.start:affected_x.stop - window_x.start]
+  new_clearance.flags.writeable = False
+  return new_clearance
+
+_OBJECT_CELL_SIZE = 4
+
+class ObjectIndex:
+  def __init__(self, objects, cell_size=_OBJECT_CELL_SIZE):
+    self.__objects = list(objects)
+    self.__cell_size = cell_size
+    self.__x = numpy.array([position.x for _, position in self.__objects], dtype=numpy.float64)
+    self.__y = numpy.array([position.y for _, position in self.__objects], dtype=numpy.float64)
+    self.__cells = collections.defaultdict(list)
+    for index, (_, position) in enumerate(self.__objects):
+      self.__cells[self.__cell(position.x, position.y)].append(index)
+    self.__cells = { cell: numpy.array(indices, dtype=numpy.intp) for cell, indices in self.__cells.items() }
+
+  def __cell(self, x, y):
+    return (int(math.floor(x / self.__cell_size)), int(math.floor(y / self.__cell_size)))
+
+  def __len__(self):
+    return len(self.__objects)
+
+  def __candidates(self, position, radius):
+    (min_x, min_y), (max_x, max_y) = self.__cell(position.x - radius, position.y - radius), self.__cell(position.x + radius, position.y + radius)
+    if (max_x - min_x + 1) * (max_y - min_y + 1) > len(self.__cells):
+      cells = [indices for (x, y), indices in self.__cells.items() if min_x <= x <= max_x and min_y <= y <= max_y]
+    else:
+      cells = [self.__cells[(x, y)] for y in range(min_y, max_y + 1) for x in range(min_x, max_x + 1) if (x, y) in self.__cells]
+    return numpy.concatenate(cells) if cells else numpy.zeros(0, dtype=numpy.intp)
+
+  def in_view(self, position, forward, radius, half_angle, margin=0):
+    candidates = self.__candidates(position, radius)
+    forward = forward.normalize()
+    dx, dy = self.__x[candidates] - position.x, self.__y[candidates] - position.y
+    distances = numpy.sqrt(dx*dx + dy*dy)
+    ahead = forward.x*dx + forward.y*dy
+    side = numpy.abs(forward.x*dy - forward.y*dx)
+    inside_cone = side*math.cos(half_angle.to_radians()) - ahead*math.sin(half_angle.to_radians()) <= margin
+    return self.__ordered(candidates, distances, (distances <= radius) & (ahead >= 0) & inside_cone)
+
+  def __ordered(self, candidates, distances, selected):
+    candidates, distances = candidates[selected], distances[selected]
+    order = numpy.lexsort((candidates, distances))
+    return [self.__objects[index] for index in candidates[order].tolist()]
+
+class Map:
+  def __init__(self, materials, objects, width, version=0):
+    self.__cells = _to_cells(materials)
+    self.__objects = objects
+    self.__width = width
+    self.__version = version
+    self.__grid = None
+    self.__clearance = None
+    self.__object_index = None
+
+  @property
+  def cells(self):
+    return self.__cells
+
+  @property
+  def grid(self):
+    if self.__grid is None:
+      self.__grid = numpy.frombuffer(self.__cells, dtype=numpy.uint8).reshape(self.height, self.__width)
+    return self.__grid
+
+  @property
+  def clearance(self):
+    if self.__clearance is None:
+      self.__clearance = _compute_clearance(self.grid == _FLOOR_ID)
+      self.__clearance.flags.writeable = False
+    return self.__clearance
+
+  def clearance_at(self, x, y):
+    if x < 0 or y < 0 or x >= self.__width or y >= self.height:
+      return 0
+    return int(self.clearance[y, x])
+
+  @property
+  def materials(self):
+    return [_MATERIALS[material_id] for material_id in self.__cells]
+
+  @property
+  def objects(self):
+    return self.__objects
+
+  @property
+  def object_index(self):
+    if self.__object_index is None:
+      self.__object_index = ObjectIndex(self.__objects)
+    return self.__object_index
+
+  @property
+  def width(self):
+    return self.__width
+
+  @property
+  def height(self):
+    return len(self.__cells) // self.__width
+
+  @property
+  def version(self):
+    return self.__version
+
+  def __eq__(self, other):
+    return isinstance(other, Map) and \
+      (self.__cells, self.__objects, self.__width, self.__version) == \
+      (other.cells, other.objects, other.width, other.version)
+
+  def __repr__(self):
+    return 'Map(width=%d, height=%d, version=%d)' % (self.__width, self.height, self.__version)
+
   def __to_index(self, position):
     grid_position = position.to_grid()
-    return grid_position.y*self.width + grid_position.x
+    return grid_position.y*self.__width + grid_position.x
+
+  def material_id(self, x, y):
+    index = y*self.__width + x
+    return self.__cells[index] if index >= 0 and index < len(self.__cells) else _VOID_ID
+
+  def material_ids(self, x, y):
+    material_ids = self.grid.ravel()
+    index = y*self.__width + x
+    inside = (index >= 0) & (index < len(material_ids))
+    return numpy.where(inside, material_ids[numpy.where(inside, index, 0)], _VOID_ID)
 
   def material(self, position):
-    index = self.__to_index(position)
-    return self.materials[index] if index >= 0 and index < len(self.materials) else Material.VOID
+    grid_position = position.to_grid()
+    return _MATERIALS[self.material_id(grid_position.x, grid_position.y)]
 
   def replace_material(self, position, replacement):
     index = self.__to_index(position)
-    new_materials = list(self.materials)
-    new_materials[index] = replacement
-    return self._replace(materials=new_materials)
+    new_cells = self.__cells[:index] + bytes((replacement.value, )) + self.__cells[index+1:]
+    new_map = Map(new_cells, self.__objects, self.__width, self.__version + 1)
+    new_map.__object_index = self.__object_index
+    new_map.__derive_clearance(self, [position])
+    return new_map
+
+  def apply_delta(self, delta):
+    cells = bytearray(self.__cells)
+    for position, material in delta.changes:
+      cells[self.__to_index(position)] = material.value
+    new_map = Map(bytes(cells), self.__objects, self.__width, delta.version)
+    new_map.__object_index = self.__object_index
+    new_map.__derive_clearance(self, [position for position, _ in delta.changes])
+    return new_map
+
+  def __derive_clearance(self, previous_map, changed_positions):
+    if previous_map.__clearance is None or previous_map.__width != self.__width:
+      return
+    clearance = previous_map.__clearance
+    for position in changed_positions:
+      grid_position = position.to_grid()
+      clearance = _update_clearance(clearance, self.grid, grid_position.x, grid_position.y)
+    self.__clearance = clearance
+
+MapDelta = collections.namedtuple('MapDelta', [ 'version', 'changes', ])
+ServerSnapshot = collections.namedtuple('ServerSnapshot', [ 'world_map', 'players', 'inputs', ])
+
+class InterestGrid:
+  def __init__(self, region_size):
+    self.__region_size = region_size
+    self.__regions = {}
+    self.__names = collections.defaultdict(set)
+
+  def region(self, position):
+    return (int(math.floor(position.x / self.__region_size)), int(math.floor(position.y / self.__region_size)))
+
+  def regions_near(self, position, radius):
+    x, y = self.region(position)
+    return [(x + dx, y + dy) for dy in range(-radius, radius + 1) for dx in range(-radius, radius + 1)]
+
+  def region_of(self, name):
+    return self.__regions.get(name, None)
+
+  def names_in(self, region):
+    return self.__names.get(region, set())
+
+  def update(self, name, position):
+    previous_region = self.__regions.get(name, None)
+    region = self.region(position)
+    if region != previous_region:
+      self.remove(name)
+      self.__regions[name] = region
+      self.__names[region].add(name)
+    return previous_region
+
+  def remove(self, name):
+    region = self.__regions.pop(name, None)
+    if region is not None:
+      self.__names[region].discard(name)
+      if not self.__names[region]:
+        del self.__names[region]
 
 class SquareSide(enum.Enum):
   HORIZONTAL = 0
@@ -122,6 +435,10 @@ def find_first_collision(map, line_segment, debug=False):
   if abs(delta.x) < smallest_number and abs(delta.y) < smallest_number:
     return None
 
+  reach = max(abs(grid_end.x - grid_start.x), abs(grid_end.y - grid_start.y)) + 1
+  if reach < _MAX_CLEARANCE and map.clearance_at(grid_start.x, grid_start.y) > reach:
+    return None
+
   direction = delta.normalize()
   dy_dx = math.inf if abs(direction.x) < smallest_number else direction.y / direction.x
   dx_dy = math.inf if abs(direction.y) < smallest_number else direction.x / direction.y
@@ -162,9 +479,7 @@ def find_first_collision(map, line_segment, debug=False):
       next_vertical_crossing += vertical_crossing_distance
       y += step_y
 
-    position = Position(x, y)
-
-    if map.material(position) != Material.FLOOR:
+    if map.material_id(x, y) != _FLOOR_ID:
       if side == SquareSide.HORIZONTAL:
         distance = abs((x - start.x + (1 - step_x) / 2) / direction.x)
         wall = start.y + distance * direction.y
@@ -172,6 +487,164 @@ def find_first_collision(map, line_segment, debug=False):
         distance = abs((y - start.y + (1 - step_y) / 2) / direction.y)
         wall = start.x + distance * direction.x
 
-      return Collision(position, distance, wall, side)
+      return Collision(Position(x, y), distance, wall, side)
 
   return None
+
+Collisions = collections.namedtuple('Collisions', [ 'hit', 'x', 'y', 'distance', 'wall', 'side', ])
+
+def _clearances_at(map, x, y):
+  inside = (x >= 0) & (y >= 0) & (x < map.width) & (y < map.height)
+  return numpy.where(inside, map.clearance[numpy.where(inside, y, 0), numpy.where(inside, x, 0)], 0)
+
+def _crossings_until(next_crossing, crossing_distance, limit, inclusive):
+  with numpy.errstate(invalid='ignore'):
+    crossings = numpy.floor((limit - next_crossing) / crossing_distance) + 1
+    if not inclusive:
+      crossings[next_crossing + (crossings - 1)*crossing_distance >= limit] -= 1
+  return numpy.nan_to_num(numpy.maximum(crossings, 0)).astype(numpy.int64)
+
+def find_first_collisions(map, start, directions, max_distance, skip_empty_space=False):
+  directions = numpy.asarray(directions, dtype=numpy.float64)
+  count = len(directions)
+  grid_start_x, grid_start_y = int(math.floor(start.x)), int(math.floor(start.y))
+  end_x = start.x + directions[:, 0]*max_distance
+  end_y = start.y + directions[:, 1]*max_distance
+  delta_x, delta_y = end_x - start.x, end_y - start.y
+
+  inverse_length = 1 / (numpy.sqrt(delta_x*delta_x + delta_y*delta_y) + smallest_number)
+  direction_x, direction_y = delta_x*inverse_length, delta_y*inverse_length
+  zero_x, zero_y = numpy.abs(direction_x) < smallest_number, numpy.abs(direction_y) < smallest_number
+
+  with numpy.errstate(divide='ignore', invalid='ignore'):
+    dy_dx = numpy.where(zero_x, math.inf, direction_y / direction_x)
+    dx_dy = numpy.where(zero_y, math.inf, direction_x / direction_y)
+    horizontal_crossing_distance = numpy.sqrt(1 + dy_dx*dy_dx)
+    vertical_crossing_distance = numpy.sqrt(1 + dx_dy*dx_dy)
+
+    step_x = numpy.where(zero_x, 0, numpy.where(direction_x < 0, -1, 1))
+    next_horizontal_crossing = numpy.where(zero_x, math.inf, numpy.where(direction_x < 0,
+      horizontal_crossing_distance * (start.x - grid_start_x),
+      horizontal_crossing_distance * (grid_start_x + 1 - start.x)))
+
+    step_y = numpy.where(zero_y, 0, numpy.where(direction_y < 0, -1, 1))
+    next_vertical_crossing = numpy.where(zero_y, math.inf, numpy.where(direction_y < 0,
+      vertical_crossing_distance * (start.y - grid_start_y),
+      vertical_crossing_distance * (grid_start_y + 1 - start.y)))
+
+  remaining_steps = numpy.abs(numpy.floor(end_x).astype(numpy.int64) - grid_start_x) + \
+    numpy.abs(numpy.floor(end_y).astype(numpy.int64) - grid_start_y)
+  remaining_steps[(numpy.abs(delta_x) < smallest_number) & (numpy.abs(delta_y) < smallest_number)] = 0
+
+  x = numpy.full(count, grid_start_x, dtype=numpy.int64)
+  y = numpy.full(count, grid_start_y, dtype=numpy.int64)
+  side = numpy.zeros(count, dtype=numpy.int8)
+  hit = numpy.zeros(count, dtype=bool)
+  active = numpy.nonzero(remaining_steps > 0)[0]
+
+  while active.size > 0:
+    if skip_empty_space:
+      reach = _clearances_at(map, x[active], y[active]).astype(numpy.int64) - 1
+      jumping = active[reach >= 2]
+      if jumping.size > 0:
+        reach = reach[reach >= 2]
+        x_limit = next_horizontal_crossing[jumping] + reach*horizontal_crossing_distance[jumping]
+        y_limit = next_vertical_crossing[jumping] + reach*vertical_crossing_distance[jumping]
+        x_first = x_limit < y_limit
+        limit = numpy.where(x_first, x_limit, y_limit)
+        crossings_x = numpy.minimum(reach, _crossings_until(next_horizontal_crossing[jumping], horizontal_crossing_distance[jumping], limit, inclusive=False))
+        crossings_y = numpy.minimum(reach, _crossings_until(next_vertical_crossing[jumping], vertical_crossing_distance[jumping], limit, inclusive=True))
+        crossings_x[step_x[jumping] == 0] = 0
+        crossings_y[step_y[jumping] == 0] = 0
+
+        with numpy.errstate(invalid='ignore'):
+          next_horizontal_crossing[jumping] += numpy.where(crossings_x > 0, crossings_x*horizontal_crossing_distance[jumping], 0)
+          next_vertical_crossing[jumping] += numpy.where(crossings_y > 0, crossings_y*vertical_crossing_distance[jumping], 0)
+        x[jumping] += crossings_x*step_x[jumping]
+        y[jumping] += crossings_y*step_y[jumping]
+        remaining_steps[jumping] -= crossings_x + crossings_y
+        active = active[remaining_steps[active] > 0]
+        if active.size == 0:
+          break
+
+    horizontal = next_horizontal_crossing[active] < next_vertical_crossing[active]
+    crossing_x, crossing_y = active[horizontal], active[~horizontal]
+
+    next_horizontal_crossing[crossing_x] += horizontal_crossing_distance[crossing_x]
+    x[crossing_x] += step_x[crossing_x]
+    side[crossing_x] = SquareSide.HORIZONTAL.value
+
+    next_vertical_crossing[crossing_y] += vertical_crossing_distance[crossing_y]
+    y[crossing_y] += step_y[crossing_y]
+    side[crossing_y] = SquareSide.VERTICAL.value
+
+    remaining_steps[active] -= 1
+    solid = map.material_ids(x[active], y[active]) != _FLOOR_ID
+    hit[active[solid]] = True
+    active = active[~solid & (remaining_steps[active] > 0)]
+
+  with numpy.errstate(divide='ignore', invalid='ignore'):
+    horizontal = side == SquareSide.HORIZONTAL.value
+    distance = numpy.where(horizontal,
+      numpy.abs((x - start.x + (1 - step_x) / 2) / direction_x),
+      numpy.abs((y - start.y + (1 - step_y) / 2) / direction_y))
+    wall = numpy.where(horizontal, start.y + distance * direction_y, start.x + distance * direction_x)
+
+  distance[~hit] = math.inf
+  return Collisions(hit, x, y, distance, wall, side)
+
+_CONTACT_GAP = 1e-6
+
+def _sweep_axis(map, along, across, delta, radius, transpose):
+  if delta == 0:
+    return along
+  direction = 1 if delta > 0 else -1
+  edge = along + direction*radius
+  first_cell, last_cell = int(math.floor(edge)), int(math.floor(edge + delta))
+  first_row, last_row = int(math.floor(across - radius + _CONTACT_GAP)), int(math.floor(across + radius - _CONTACT_GAP))
+  inside = first_cell == int(math.floor(along))
+  for cell in range(first_cell + direction if inside else first_cell, last_cell + direction, direction):
+    for row in range(first_row, last_row + 1):
+      material_id = map.material_id(row, cell) if transpose else map.material_id(cell, row)
+      if material_id != _FLOOR_ID:
+        if cell == first_cell:
+          return along
+        wall = cell if direction > 0 else cell + 1
+        return wall - direction*(radius + _CONTACT_GAP)
+  return along + delta
+
+def move_with_collisions(map, position, delta, radius):
+  x = _sweep_axis(map, position.x, position.y, delta.x, radius, transpose=False)
+  y = _sweep_axis(map, position.y, x, delta.y, radius, transpose=True)
+  return Position(x, y)
+
+def _sweep_axes(map, along, across, delta, radius, transpose):
+  if along.size == 0:
+    return along
+  direction = numpy.where(delta > 0, 1, -1)
+  edge = along + direction*radius
+  first_cell, last_cell = numpy.floor(edge).astype(numpy.int64), numpy.floor(edge + delta).astype(numpy.int64)
+  first_row, last_row = numpy.floor(across - radius + _CONTACT_GAP).astype(numpy.int64), numpy.floor(across + radius - _CONTACT_GAP).astype(numpy.int64)
+  steps = numpy.where(delta == 0, -1, numpy.abs(last_cell - first_cell))
+  inside = first_cell == numpy.floor(along).astype(numpy.int64)
+
+  result = numpy.where(delta == 0, along, along + delta)
+  blocked = numpy.zeros(along.shape, dtype=bool)
+  for step in range(int(steps.max()) + 1):
+    cell = first_cell + direction*step
+    for row_offset in range(int((last_row - first_row).max()) + 1):
+      row = first_row + row_offset
+      checked = ~blocked & (step <= steps) & (row <= last_row) & ~(inside & (step == 0))
+      material_ids = map.material_ids(row, cell) if transpose else map.material_ids(cell, row)
+      solid = checked & (material_ids != _FLOOR_ID)
+      wall = numpy.where(direction > 0, cell, cell + 1)
+      stop = along if step == 0 else wall - direction*(radius + _CONTACT_GAP)
+      result = numpy.where(solid, stop, result)
+      blocked |= solid
+  return result
+
+def moves_with_collisions(map, positions, deltas, radius):
+  positions, deltas = numpy.asarray(positions, dtype=numpy.float64), numpy.asarray(deltas, dtype=numpy.float64)
+  x = _sweep_axes(map, positions[:, 0], positions[:, 1], deltas[:, 0], radius, transpose=False)
+  y = _sweep_axes(map, positions[:, 1], x, deltas[:, 1], radius, transpose=True)
+  return numpy.stack((x, y), axis=-1)
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+
+import argparse
+import collections
+import json
+import math
+import sys
+import threading
+import time
+import traceback
+
+import zmq
+
+from adapter_persistence import read_journal
+from adapter_pygame import load_map, load_player_spawn
+from adapter_zmq import ServerConnection
+from domain import Angle, initial_input, PlayerInput
+from metrics import Metrics
+from use_case import move_player, rotate_player
+
+_POLL_INTERVAL = 0.002
+_SENT_PLAYERS_PER_NAME = 64
+
+def _walk_script(world_map, spawn, name, index, clients, args):
+  step_time = 1 / args.rate
+  walking = initial_input._replace(forward=True)
+  turning = initial_input._replace(turn_right=True)
+  player = spawn._replace(name=name, forward=spawn.forward.rotate(Angle.from_radians(2 * math.pi * index / clients)))
+  yield 0.0, 'join', name
+  for step in range(int(args.duration * args.rate)):
+    moved = move_player(player, world_map, walking, step_time, speed=5)
+    player = moved if moved != player else rotate_player(player, turning, step_time * 10, speed=3)
+    yield step * step_time, 'move', player
+    if args.activate_every and step % args.activate_every == args.activate_every - 1:
+      yield step * step_time, 'activate', name
+  yield args.duration, 'leave', name
+
+def _input_script(world_map, spawn, name, index, clients, args):
+  step_time = 1 / args.rate
+  walking = initial_input._replace(forward=True)
+  turning = initial_input._replace(turn_right=True)
+  turn_steps = 1 + index % 5
+  yield 0.0, 'join', name
+  for step in range(int(args.duration * args.rate)):
+    input = turning if step % args.rate < turn_steps else walking
+    yield step * step_time, 'input', PlayerInput(name, step + 1, input)
+    if args.activate_every and step % args.activate_every == args.activate_every - 1:
+      yield step * step_time, 'activate', name
+  yield args.duration, 'leave', name
+
+def _player_name(command_name, input_data):
+  return input_data if isinstance(input_data, str) else input_data.name
+
+def _replay_scripts(path, speed):
+  records = [(record_time, command_name, input_data) for record_time, command_name, input_data in read_journal(path) if command_name != 'tick']
+  if not records:
+    return []
+  start = records[0][0]
+  scripts = collections.OrderedDict()
+  for record_time, command_name, input_data in records:
+    script = scripts.setdefault(_player_name(command_name, input_data), [])
+    script.append(((record_time - start) / speed, command_name, input_data))
+  return list(scripts.values())
+
+class _Results:
+  def __init__(self):
+    self.__lock = threading.Lock()
+    self.__sent_players = collections.defaultdict(lambda: collections.deque(maxlen=_SENT_PLAYERS_PER_NAME))
+    self.metrics = Metrics()
+    self.commands = collections.Counter()
+    self.errors = collections.Counter()
+    self.skipped = 0
+    self.events = 0
+
+  def move_sent(self, player, sent_time):
+    with self.__lock:
+      self.__sent_players[player.name].append((player, sent_time))
+
+  def command_done(self, command_name, round_trip_time, failed):
+    with self.__lock:
+      self.commands[command_name] += 1
+      if failed:
+        self.errors[command_name] += 1
+      else:
+        self.metrics.add('round_trip', round_trip_time)
+
+  def session_aborted(self, skipped):
+    with self.__lock:
+      self.skipped += skipped
+
+  def event_received(self, event_name, event_data, receive_time):
+    with self.__lock:
+      self.events += 1
+      if event_name != 'player':
+        return
+      sent_time = next((sent_time for player, sent_time in self.__sent_players.get(event_data.name, ()) if player == event_data), None)
+      if sent_time is not None:
+        self.metrics.add('fan_out', receive_time - sent_time)
+
+class _Session(threading.Thread):
+  def __init__(self, host, port, timeout, script, results, start_time):
+    super().__init__(daemon=True)
+    self.__host = host
+    self.__port = port
+    self.__timeout = timeout
+    self.__script = script
+    self.__results = results
+    self.__start_time = start_time
+
+  def run(self):
+    connection = ServerConnection(self.__host, self.__port, timeout=self.__timeout)
+    self.__next_command = 0
+    try:
+      self.__run_script(connection)
+    except Exception:
+      traceback.print_exc()
+      self.__results.session_aborted(len(self.__script) - self.__next_command)
+    finally:
+      connection.close()
+
+  def __run_script(self, connection):
+    seen = {}
+    for offset, command_name, input_data in self.__script:
+      while True:
+        self.__poll_events(connection, seen)
+        remaining = self.__start_time + offset - time.perf_counter()
+        if remaining <= 0:
+          break
+        time.sleep(min(remaining, _POLL_INTERVAL))
+
+      start = time.perf_counter()
+      if command_name == 'move':
+        self.__results.move_sent(input_data, start)
+      self.__next_command += 1
+      try:
+        output_data = connection.call(command_name, input_data)
+      except zmq.Again:
+        self.__results.command_done(command_name, time.perf_counter() - start, failed=True)
+        self.__results.session_aborted(len(self.__script) - self.__next_command)
+        return
+      except Exception:
+        self.__results.command_done(command_name, time.perf_counter() - start, failed=True)
+        continue
+      self.__results.command_done(command_name, time.perf_counter() - start, failed=False)
+
+      if command_name == 'join' and output_data:
+        connection.update_interest(output_data.position)
+      elif command_name == 'move':
+        connection.update_interest(input_data.position)
+
+  def __poll_events(self, connection, seen):
+    for event_name, event_data in connection.poll_events():
+      if event_name == 'player':
+        if seen.get(event_data.name) == event_data:
+          continue
+        seen[event_data.name] = event_data
+      self.__results.event_received(event_name, event_data, time.perf_counter())
+
+def _percentiles_ms(histogram):
+  return dict(p50=histogram.percentile(50)*1000, p99=histogram.percentile(99)*1000, max=histogram.maximum*1000)
+
+def _run(scripts, args):
+  results = _Results()
+  start_time = time.perf_counter() + 0.5
+  sessions = [_Session(args.host, args.port, args.timeout, script, results, start_time + index * args.stagger) for index, script in enumerate(scripts)]
+  for session in sessions:
+    session.start()
+  for session in sessions:
+    session.join()
+  elapsed = time.perf_counter() - start_time
+
+  commands = sum(results.commands.values())
+  return dict(
+    clients=len(sessions),
+    seconds=elapsed,
+    commands=commands,
+    commands_per_second=commands / elapsed,
+    errors=sum(results.errors.values()),
+    skipped=results.skipped,
+    commands_by_name=dict(results.commands),
+    events=results.events,
+    round_trip_ms=_percentiles_ms(results.metrics.histogram('round_trip')),
+    fan_out_ms=_percentiles_ms(results.metrics.histogram('fan_out')),
+  )
+
+def _print_result(result):
+  print('{clients} clients, {seconds:.1f} s: {commands} commands ({commands_per_second:.0f}/s), {errors} errors, {skipped} skipped, {events} events'.format(**result))
+  print('  round trip ms  p50 {p50:7.2f}  p99 {p99:7.2f}  max {max:7.2f}'.format(**result['round_trip_ms']))
+  print('  fan-out ms     p50 {p50:7.2f}  p99 {p99:7.2f}  max {max:7.2f}'.format(**result['fan_out_ms']))
+
+def main(args):
+  if args.replay:
+    scripts = _replay_scripts(args.replay, args.speed)
+  else:
+    world_map = load_map(path=args.map)
+    spawn = load_player_spawn(path=args.map)
+    create_script = _input_script if args.authoritative else _walk_script
+    scripts = [list(create_script(world_map, spawn, 'load{}'.format(index), index, args.clients, args)) for index in range(args.clients)]
+
+  result = _run(scripts, args)
+  _print_result(result)
+
+  if args.json:
+    with open(args.json, 'w') as file:
+      json.dump(result, file, indent=2)
+
+  slow = args.max_p99_ms and result['round_trip_ms']['p99'] > args.max_p99_ms
+  if slow:
+    print('p99 round trip time {:.2f} ms exceeds {:.2f} ms'.format(result['round_trip_ms']['p99'], args.max_p99_ms), file=sys.stderr)
+  return 1 if slow or result['errors'] or result['skipped'] else 0
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--host", default="localhost")
+  parser.add_argument("--port", type=int, default=12345)
+  parser.add_argument("--map", default="map", help="map directory the server was started with")
+  parser.add_argument("--timeout", type=float, default=5, help="seconds to wait for a reply before giving up on a client")
+  parser.add_argument("--clients", type=int, default=16)
+  parser.add_argument("--duration", type=float, default=10, help="seconds each client stays connected")
+  parser.add_argument("--rate", type=int, default=20, help="commands per second per client")
+  parser.add_argument("--stagger", type=float, default=0.01, help="seconds between client starts")
+  parser.add_argument("--activate-every", type=int, default=40, help="send activate after this many moves, 0 to never")
+  parser.add_argument("--authoritative", action="store_true", help="send inputs instead of moves, for servers started with --authoritative")
+  parser.add_argument("--replay", help="replay the session journaled in this server --state-dir (run with --keep-journal) instead of scripted clients")
+  parser.add_argument("--speed", type=float, default=1, help="replay speed-up factor")
+  parser.add_argument("--json", help="also write the results to this file")
+  parser.add_argument("--max-p99-ms", type=float, help="exit with status 1 if the p99 round trip time is above this")
+  args = parser.parse_args()
+  sys.exit(main(args))
@@ -0,0 +1,109 @@
+import collections
+import json
+import math
+import time
+
+class Histogram:
+  def __init__(self, max_samples=10000):
+    self.__samples = collections.deque(maxlen=max_samples)
+    self.count = 0
+    self.total = 0
+    self.maximum = 0
+
+  def add(self, value):
+    self.__samples.append(value)
+    self.count += 1
+    self.total += value
+    self.maximum = max(self.maximum, value)
+
+  def mean(self):
+    return self.total / self.count if self.count > 0 else 0
+
+  def percentile(self, percent):
+    if not self.__samples:
+      return 0
+    samples = sorted(self.__samples)
+    index = int(math.ceil(percent / 100 * len(samples))) - 1
+    return samples[max(0, min(len(samples) - 1, index))]
+
+  def summary(self):
+    return collections.OrderedDict([('count', self.count), ('mean', self.mean()), ('p50', self.percentile(50)), ('p99', self.percentile(99)), ('max', self.maximum)])
+
+class _Timer:
+  def __init__(self, histogram):
+    self.__histogram = histogram
+
+  def __enter__(self):
+    self.__start = time.perf_counter()
+
+  def __exit__(self, *exception):
+    self.__histogram.add(time.perf_counter() - self.__start)
+
+class Metrics:
+  def __init__(self):
+    self.histograms = collections.OrderedDict()
+    self.counters = collections.OrderedDict()
+
+  def histogram(self, name):
+    if name not in self.histograms:
+      self.histograms[name] = Histogram()
+    return self.histograms[name]
+
+  def time(self, name):
+    return _Timer(self.histogram(name))
+
+  def add(self, name, value):
+    self.histogram(name).add(value)
+
+  def count(self, name, value=1):
+    self.counters[name] = self.counters.get(name, 0) + value
+
+  def summary(self):
+    return collections.OrderedDict([
+      ('counters', collections.OrderedDict(self.counters)),
+      ('histograms', collections.OrderedDict((name, histogram.summary()) for name, histogram in self.histograms.items())),
+    ])
+
+  def clear(self):
+    self.histograms.clear()
+    self.counters.clear()
+
+class _NullTimer:
+  def __enter__(self):
+    pass
+
+  def __exit__(self, *exception):
+    pass
+
+class NullMetrics:
+  __timer = _NullTimer()
+
+  def time(self, name):
+    return self.__timer
+
+  def add(self, name, value):
+    pass
+
+  def count(self, name, value=1):
+    pass
+
+class PeriodicDump:
+  def __init__(self, metrics, file, interval):
+    self.__metrics = metrics
+    self.__file = file
+    self.__interval = interval
+    self.__next_dump = time.monotonic() + interval
+
+  def update(self):
+    now = time.monotonic()
+    if now < self.__next_dump:
+      return
+    self.__next_dump = max(self.__next_dump + self.__interval, now)
+    self.dump()
+
+  def dump(self):
+    summary = self.__metrics.summary()
+    summary['time'] = time.time()
+    self.__file.write(json.dumps(summary) + '\n')
+    self.__file.flush()
+    self.__metrics.clear()
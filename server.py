@@ -1,17 +1,40 @@
 import argparse
+import contextlib
+import io
 import sys
+import time
 
+from adapter_persistence import Journal
 from adapter_pygame import load_links, load_map, load_player_spawn
 from adapter_zmq import Server
-from server_use_case import handle_command, initial_state
+from metrics import Metrics, NullMetrics, PeriodicDump
+from server_use_case import handle_command, handle_tick, initial_state, restore_snapshot, take_snapshot
+
+_JOURNALED_COMMANDS = {'activate', 'input', 'join', 'leave', 'move'}
 
 def main(args):
-  server = Server(args.port)
+  metrics = Metrics() if args.stats_interval else NullMetrics()
+  stats_file = open(args.stats_file, 'a') if args.stats_interval and args.stats_file else None
+  stats = PeriodicDump(metrics, stats_file or sys.stderr, args.stats_interval) if args.stats_interval else None
+  server = Server(args.port, tick_rate=args.tick_rate, metrics=metrics)
   player_spawn = load_player_spawn(path='map')
   world_map = load_map(path='map')
   links = load_links(path='map')
 
-  state = initial_state(player_spawn, world_map, links)
+  state = initial_state(player_spawn, world_map, links, authoritative=args.authoritative)
+
+  journal = Journal(args.state_dir, keep_segments=args.keep_journal) if args.state_dir else None
+  if journal:
+    state = restore_snapshot(state, journal.snapshot) if journal.snapshot else state
+    records = journal.replay()
+    with contextlib.redirect_stdout(io.StringIO()):
+      for command_name, input_data in records:
+        if command_name == 'tick':
+          state, _ = handle_tick(state, input_data)
+        else:
+          state, _, _ = handle_command(state, command_name, input_data)
+    print("Recovered {} players and {} journal records".format(len(state.players), len(records)))
+  next_snapshot = time.monotonic() + args.snapshot_interval
 
   def command_fn(command_name, input_data):
     nonlocal state
@@ -19,14 +42,43 @@ def main(args):
     for event_name, event_data in events:
       server.emit_event(event_name, event_data)
     state = next_state
+    if journal and command_name in _JOURNALED_COMMANDS:
+      journal.record(command_name, input_data)
     return output_data
 
-  server.serve(command_fn)
+  def tick_fn(frame_time):
+    nonlocal state, next_snapshot
+    state, events = handle_tick(state, frame_time)
+    for event_name, event_data in events:
+      server.emit_event(event_name, event_data)
+    if journal and events:
+      journal.record('tick', frame_time)
+    if journal and time.monotonic() >= next_snapshot:
+      journal.save_snapshot(take_snapshot(state))
+      next_snapshot = time.monotonic() + args.snapshot_interval
+
+  try:
+    server.serve(command_fn, tick_fn, after_tick_fn=stats.update if stats else None)
+  finally:
+    if journal:
+      journal.save_snapshot(take_snapshot(state))
+      journal.close()
+    if stats:
+      stats.dump()
+    if stats_file:
+      stats_file.close()
 
   return 0
 
 if __name__ == '__main__':
   parser = argparse.ArgumentParser()
   parser.add_argument("--port", type=int, default=12345)
+  parser.add_argument("--tick-rate", type=int, default=20)
+  parser.add_argument("--authoritative", action="store_true")
+  parser.add_argument("--state-dir")
+  parser.add_argument("--snapshot-interval", type=float, default=60)
+  parser.add_argument("--keep-journal", action="store_true", help="keep journal segments after snapshots, to replay the session with loadgen.py")
+  parser.add_argument("--stats-interval", type=float, help="write timings and counters as a JSON line this often, in seconds")
+  parser.add_argument("--stats-file", help="append the stats to this file (default: stderr)")
   args = parser.parse_args()
   sys.exit(main(args))
@@ -1,12 +1,24 @@
-from domain import Material
+from domain import InputAck, MapDelta, Material, PlayerInput, PlayerTable, ServerSnapshot
+from use_case import move_players, rotate_players
 
 from collections import namedtuple
 from random import randint
+import numpy
 
-_State = namedtuple('_State', 'player_spawn, world_map, links, players')
+_State = namedtuple('_State', 'player_spawn, world_map, links, players, inputs, authoritative, rotation_speed, movement_speed')
 
-def initial_state(player_spawn, world_map, links):
-  return _State(player_spawn, world_map, links, {})
+def initial_state(player_spawn, world_map, links, authoritative=False, rotation_speed=3, movement_speed=5):
+  return _State(player_spawn, world_map, links, PlayerTable(), {}, authoritative, rotation_speed, movement_speed)
+
+def take_snapshot(state):
+  inputs = [PlayerInput(name, 0, input) for name, input in state.inputs.items()]
+  return ServerSnapshot(state.world_map, state.players.values(), inputs)
+
+def restore_snapshot(state, snapshot):
+  state = state._replace(world_map=snapshot.world_map, players=PlayerTable(snapshot.players), inputs={})
+  for player_input in snapshot.inputs:
+    state.inputs[player_input.name] = player_input.input
+  return state
 
 def handle_command(state, command_name, input_data):
   output_data = None
@@ -21,7 +33,7 @@ def handle_command(state, command_name, input_data):
       new_material = Material.DOOR if state.world_map.material(door_pos) == Material.FLOOR else Material.FLOOR
       new_world_map = state.world_map.replace_material(door_pos, new_material)
       state = state._replace(world_map=new_world_map)
-      events.append(('world_map', new_world_map))
+      events.append(('map_delta', MapDelta(new_world_map.version, [(door_pos.to_grid(), new_material)])))
   elif command_name == 'get_world_map':
     output_data = state.world_map
   elif command_name == 'join':
@@ -38,13 +50,40 @@ def handle_command(state, command_name, input_data):
   elif command_name == 'leave':
     name = input_data
     assert name in state.players
+    state.inputs.pop(name, None)
     events.append(('player_left', name))
     print("Player left: " + name)
+  elif command_name == 'input':
+    player_input = input_data
+    assert state.authoritative
+    assert player_input.name in state.players
+    state.inputs[player_input.name] = player_input.input
+    output_data = InputAck(player_input.sequence, state.players[player_input.name])
   elif command_name == 'move':
     player = input_data
+    assert not state.authoritative
     assert player.name in state.players
     state.players[player.name] = player
     events.append(('player', player))
   else:
     raise NotImplementedError()
   return state, output_data, events
+
+def handle_tick(state, frame_time):
+  events = []
+  names = [name for name, input in state.inputs.items() if input.forward or input.turn_right]
+  if not names:
+    return state, events
+
+  indices = numpy.array([state.players.index(name) for name in names], dtype=numpy.intp)
+  turning = numpy.array([state.inputs[name].turn_right for name in names], dtype=bool)
+  moving = numpy.array([state.inputs[name].forward for name in names], dtype=bool)
+
+  positions, forwards = state.players.positions[indices], state.players.forwards[indices]
+  new_forwards = rotate_players(forwards, turning, frame_time, state.rotation_speed)
+  new_positions = move_players(positions, new_forwards, moving, state.world_map, frame_time, state.movement_speed)
+  state.players.positions[indices], state.players.forwards[indices] = new_positions, new_forwards
+
+  changed = indices[((new_positions != positions) | (new_forwards != forwards)).any(axis=1)]
+  events.extend(('player', player) for player in state.players.players(changed))
+  return state, events
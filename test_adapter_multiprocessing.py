@@ -0,0 +1,22 @@
+import math
+import numpy
+
+from adapter_multiprocessing import *
+from domain import *
+
+F, W = Material.FLOOR, Material.WALL
+ROOM = Map(materials=[W if x in (0, 9) or y in (0, 9) or (x, y) == (6, 3) else F for y in range(10) for x in range(10)],
+           objects=[],
+           width=10)
+DIRECTIONS = numpy.array([(math.cos(2 * math.pi * i / 40), math.sin(2 * math.pi * i / 40)) for i in range(40)])
+
+def test_parallel_raycaster_matches_find_first_collisions():
+  raycaster = ParallelRaycaster(processes=2)
+  try:
+    for world_map in [ROOM, ROOM.replace_material(Position(6.5, 3.5), Material.FLOOR)]:
+      expected = find_first_collisions(world_map, Position(3.5, 4.25), DIRECTIONS, 100)
+      collisions = raycaster(world_map, Position(3.5, 4.25), DIRECTIONS, 100)
+      for field, expected_field in zip(collisions, expected):
+        assert (field == expected_field).all()
+  finally:
+    raycaster.close()
@@ -0,0 +1,103 @@
+import os
+import shutil
+
+import pytest
+
+from adapter_persistence import *
+from domain import Direction, initial_input, Map, Material, Player, PlayerInput, Position, ServerSnapshot
+
+MAP = Map(materials=[Material.FLOOR, Material.DOOR, Material.FLOOR, Material.WALL],
+          objects=[],
+          width=2,
+          version=3)
+PLAYER = Player(name='test',
+                position=Position(0.5, 0.5),
+                forward=Direction(1.0, 0.0))
+INPUT = PlayerInput('test', 2, initial_input._replace(forward=True))
+
+def test_journal_replays_recorded_commands(tmpdir):
+  journal = Journal(str(tmpdir))
+  journal.record('join', 'test')
+  journal.record('input', INPUT)
+  journal.record('tick', 0.05)
+  journal.close()
+
+  journal = Journal(str(tmpdir))
+  assert journal.snapshot is None
+  assert journal.replay() == [('join', 'test'), ('input', INPUT), ('tick', 0.05)]
+  journal.close()
+  times = [record_time for record_time, _, _ in read_journal(str(tmpdir))]
+  assert times == sorted(times) and len(times) == 3
+
+def test_snapshot_replaces_older_journal_records(tmpdir):
+  journal = Journal(str(tmpdir))
+  journal.record('join', 'test')
+  journal.save_snapshot(ServerSnapshot(MAP, [PLAYER], [INPUT]))
+  journal.record('move', PLAYER)
+  journal.close()
+
+  journal = Journal(str(tmpdir))
+  assert journal.snapshot == ServerSnapshot(MAP, [PLAYER], [INPUT])
+  assert journal.replay() == [('move', PLAYER)]
+  journal.record('leave', 'test')
+  journal.close()
+
+  journal = Journal(str(tmpdir))
+  assert journal.replay() == [('move', PLAYER), ('leave', 'test')]
+  journal.close()
+
+def test_torn_journal_tail_is_dropped(tmpdir):
+  journal = Journal(str(tmpdir))
+  journal.record('join', 'test')
+  journal.record('activate', 'test')
+  journal.close()
+  segment = str(tmpdir.listdir()[0])
+  size = os.path.getsize(segment)
+  with open(segment, 'r+b') as file:
+    file.truncate(size - 3)
+
+  assert [name for _, name, _ in read_journal(str(tmpdir))] == ['join']
+  assert os.path.getsize(segment) == size - 3
+
+  journal = Journal(str(tmpdir))
+  assert journal.replay() == [('join', 'test')]
+  journal.record('leave', 'test')
+  journal.close()
+
+  journal = Journal(str(tmpdir))
+  assert journal.replay() == [('join', 'test'), ('leave', 'test')]
+  journal.close()
+
+def test_kept_journal_replays_the_whole_session(tmpdir):
+  journal = Journal(str(tmpdir), keep_segments=True)
+  journal.record('join', 'test')
+  journal.save_snapshot(ServerSnapshot(MAP, [PLAYER], []))
+  journal.record('leave', 'test')
+  journal.close()
+
+  journal = Journal(str(tmpdir), keep_segments=True)
+  assert journal.replay() == [('leave', 'test')]
+  journal.close()
+  assert [(name, input_data) for _, name, input_data in read_journal(str(tmpdir))] == [('join', 'test'), ('leave', 'test')]
+
+def test_corrupt_record_before_the_last_segment_is_an_error(tmpdir):
+  for name in ['first', 'second']:
+    journal = Journal(str(tmpdir))
+    journal.record('join', name)
+    journal.record('leave', name)
+    journal.close()
+  first_segment = str(sorted(tmpdir.listdir())[0])
+  with open(first_segment, 'r+b') as file:
+    file.seek(-1, os.SEEK_END)
+    file.write(b'?')
+
+  with pytest.raises(ValueError):
+    Journal(str(tmpdir))
+
+def test_writer_failures_are_raised_to_the_caller(tmpdir):
+  path = str(tmpdir.join('state'))
+  journal = Journal(path)
+  shutil.rmtree(path)
+  journal.record('join', 'test')
+  with pytest.raises(IOError):
+    journal.close()
@@ -0,0 +1,62 @@
+import math
+
+import numpy
+
+from adapter_pygame import _Camera, _load_map_cache, _save_map_cache, _Size, ResolutionScaler
+from domain import Angle, Direction, Player, Position
+
+TARGET = 1 / 60
+
+def _run(scaler, frame_time, frames):
+  for _ in range(frames):
+    scaler.update(frame_time)
+  return scaler.scale
+
+def test_resolution_scaler_lowers_scale_when_frames_are_slow_and_restores_it():
+  scaler = ResolutionScaler(TARGET, cooldown=5)
+  assert scaler.scale == 1
+  assert _run(scaler, 2 * TARGET, 200) == 0.25
+  assert _run(scaler, 0.5 * TARGET, 200) == 1
+
+def test_resolution_scaler_waits_for_the_cooldown_between_changes():
+  scaler = ResolutionScaler(TARGET, cooldown=10)
+  scales = [scaler.update(10 * TARGET) for _ in range(20)]
+  assert scales[:9] == [1] * 9
+  assert scales[9:19] == [0.875] * 10
+  assert scales[19] == 0.75
+
+def test_resolution_scaler_keeps_scale_within_target_band():
+  scaler = ResolutionScaler(TARGET, cooldown=1)
+  assert _run(scaler, TARGET, 100) == 1
+
+def test_resolution_scaler_reacts_to_frames_slower_than_twenty_fps():
+  scaler = ResolutionScaler(1 / 10, cooldown=5)
+  assert _run(scaler, 0.2, 100) < 1
+
+def test_resolution_scaler_minimum_never_exceeds_maximum():
+  scaler = ResolutionScaler(TARGET, maximum=0.125, cooldown=1)
+  assert _run(scaler, 2 * TARGET, 50) == 0.125
+  assert _run(scaler, 0.5 * TARGET, 50) == 0.125
+
+def test_camera_rotates_the_precomputed_rays_by_the_player_direction():
+  for angle in [0.0, 0.3, 2.0, -2.5]:
+    forward = Direction(math.cos(angle), math.sin(angle))
+    camera = _Camera(Player('test', Position(1.5, 1.5), forward), _Size(320, 200), Angle.from_degrees(66))
+    directions = camera.directions_for_columns()
+    assert numpy.allclose(numpy.hypot(directions[:, 0], directions[:, 1]), 1)
+    assert numpy.allclose(camera.fisheye_factors(), directions[:, 0]*forward.x + directions[:, 1]*forward.y)
+    assert camera.column_for_direction(Direction(0.0, 1.0)) == 160
+
+def test_map_cache_ignores_a_corrupt_cache_file(tmpdir):
+  materials, objects = numpy.zeros((2, 3), dtype=numpy.uint8), numpy.full((2, 3), 255, dtype=numpy.uint8)
+  source_mtimes = numpy.array([1.0, 2.0])
+  _save_map_cache(str(tmpdir), source_mtimes, materials, objects)
+  cached_materials, cached_objects = _load_map_cache(str(tmpdir), source_mtimes)
+  assert numpy.array_equal(cached_materials, materials) and numpy.array_equal(cached_objects, objects)
+  assert [path.basename for path in tmpdir.listdir()] == ['map_cache.npz']
+
+  data = tmpdir.join('map_cache.npz').read_binary()
+  tmpdir.join('map_cache.npz').write_binary(data[:len(data) // 2])
+  assert _load_map_cache(str(tmpdir), source_mtimes) is None
+  tmpdir.join('map_cache.npz').write_binary(b'')
+  assert _load_map_cache(str(tmpdir), source_mtimes) is None
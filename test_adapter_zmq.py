@@ -0,0 +1,205 @@
+import random
+import threading
+import time
+
+import zmq
+
+import adapter_zmq
+from adapter_zmq import *
+from adapter_zmq import _EVENT_TYPES, _ListOf, _topic
+from domain import Direction, initial_input, InputAck, Map, MapDelta, Material, Object, Player, PlayerInput, Position
+
+MAP = Map(materials=[Material.WALL, Material.FLOOR, Material.DOOR,
+                     Material.FLOOR, Material.FLOOR, Material.WINDOW],
+          objects=[(Object.KEY, Position(1.5, 0.5)), (Object.DESK, Position(0.5, 1.5))],
+          width=3,
+          version=4)
+PLAYER = Player(name='test',
+                position=Position(1.25, 0.75),
+                forward=Direction(0.0, -1.0))
+MAP_DELTA = MapDelta(version=5, changes=[(Position(2, 0), Material.FLOOR)])
+PLAYER_INPUT = PlayerInput(name='test', sequence=7, input=initial_input._replace(forward=True, activate=True))
+INTEREST_POSITION = Position(4.0, 4.0)
+VALUES = [(Map, MAP), (Player, PLAYER), (MapDelta, MAP_DELTA), (PlayerInput, PLAYER_INPUT), (InputAck, InputAck(7, PLAYER)), (str, 'test'), (NoneType, None), (Material, Material.DART)]
+
+def test_json_codec_round_trip():
+  codec = JsonCodec()
+  for Type, value in VALUES:
+    assert codec.decode(Type, codec.encode(Type, value)) == value
+
+def test_binary_codec_round_trip():
+  codec = BinaryCodec()
+  for Type, value in VALUES:
+    assert codec.decode(Type, codec.encode(Type, value)) == value
+
+def test_binary_codec_is_smaller_than_json():
+  assert len(BinaryCodec().encode(Player, PLAYER)) < len(JsonCodec().encode(Player, PLAYER))
+
+def test_codecs_round_trip_player_batches():
+  players = [PLAYER, PLAYER._replace(name='other')]
+  for codec in [JsonCodec(), BinaryCodec()]:
+    assert codec.decode(_ListOf(Player), codec.encode(_ListOf(Player), players)) == players
+
+def test_coalesce_events_keeps_latest_state_per_player():
+  moved = PLAYER._replace(position=Position(1.5, 0.75))
+  other = PLAYER._replace(name='other')
+  events = [('player', PLAYER), ('map_delta', MAP_DELTA), ('player', other), ('player', moved),
+            ('player_left', 'other'), ('map_delta', MAP_DELTA._replace(version=6))]
+  assert coalesce_events(events) == [('map_delta', MAP_DELTA), ('player', moved), ('player_left', 'other'), ('map_delta', MAP_DELTA._replace(version=6))]
+  assert coalesce_events([('player_left', 'test'), ('player', PLAYER)]) == [('player', PLAYER)]
+  assert coalesce_events([('player', PLAYER._replace(name='world_map')), ('world_map', MAP)]) == [('player', PLAYER._replace(name='world_map')), ('world_map', MAP)]
+
+def _publisher_and_connection():
+  context = zmq.Context.instance()
+  publisher = context.socket(zmq.PUB)
+  publisher.setsockopt(zmq.LINGER, 0)
+  port = publisher.bind_to_random_port('tcp://127.0.0.1', min_port=20001, max_port=30000)
+  connection = ServerConnection('127.0.0.1', port - 1)
+  connection.update_interest(INTEREST_POSITION)
+  probe = PLAYER._replace(name='probe')
+  deadline = time.perf_counter() + 5
+  while ('player', probe) not in connection.poll_events():
+    assert time.perf_counter() < deadline
+    _publish(publisher, 'players', [probe], (0, 0))
+    time.sleep(0.01)
+  return publisher, connection
+
+def _publish(publisher, event_name, event_data, region):
+  data = JsonCodec().encode(_EVENT_TYPES[event_name], event_data)
+  publisher.send_multipart([_topic('json', region), event_name.encode(), data])
+
+def _wait_for_frames():
+  time.sleep(0.2)
+
+def test_poll_events_keeps_players_batches_until_a_keyframe_supersedes_them():
+  publisher, connection = _publisher_and_connection()
+  try:
+    other = PLAYER._replace(name='other')
+    _publish(publisher, 'players', [PLAYER, other], (0, 0))
+    _publish(publisher, 'players', [PLAYER._replace(position=Position(2.5, 0.75))], (0, 0))
+    _publish(publisher, 'players', [PLAYER._replace(name='third')], (1, 0))
+    _wait_for_frames()
+
+    assert connection.poll_events(budget=0) == [('player', PLAYER), ('player', other)]
+    assert connection.poll_events(budget=0) == [('player', PLAYER._replace(position=Position(2.5, 0.75)))]
+    assert connection.poll_events(budget=0) == [('player', PLAYER._replace(name='third'))]
+    assert connection.poll_events(budget=0) == []
+  finally:
+    connection.close()
+    publisher.close()
+
+def test_poll_events_drops_batches_older_than_a_keyframe_for_their_region():
+  publisher, connection = _publisher_and_connection()
+  try:
+    moved = PLAYER._replace(position=Position(3.5, 0.75))
+    other = PLAYER._replace(name='other')
+    for x in [1.5, 2.5]:
+      _publish(publisher, 'players', [PLAYER._replace(position=Position(x, 0.75))], (0, 0))
+    _publish(publisher, 'players', [other], (1, 0))
+    _publish(publisher, 'keyframe', [moved, PLAYER._replace(name='idle')], (0, 0))
+    _publish(publisher, 'players', [moved._replace(position=Position(4.5, 0.75))], (0, 0))
+    _wait_for_frames()
+
+    assert connection.poll_events(budget=0) == [('player', other)]
+    assert connection.poll_events(budget=0) == [('player', moved), ('player', PLAYER._replace(name='idle'))]
+    assert connection.poll_events() == [('player', moved._replace(position=Position(4.5, 0.75)))]
+  finally:
+    connection.close()
+    publisher.close()
+
+def test_poll_events_drops_the_oldest_frames_beyond_the_backlog_limit(monkeypatch):
+  monkeypatch.setattr(adapter_zmq, '_MAX_EVENT_BACKLOG', 2)
+  publisher, connection = _publisher_and_connection()
+  try:
+    for name, region in [('first', (0, 0)), ('second', (1, 0)), ('third', (0, 1))]:
+      _publish(publisher, 'players', [PLAYER._replace(name=name)], region)
+    _wait_for_frames()
+    assert connection.poll_events() == [('player', PLAYER._replace(name='second')), ('player', PLAYER._replace(name='third'))]
+  finally:
+    connection.close()
+    publisher.close()
+
+def test_flush_sends_a_coalesced_command_again_after_its_reply_is_lost(monkeypatch):
+  monkeypatch.setattr(adapter_zmq, '_REPLY_TIMEOUT', 0.1)
+  context = zmq.Context.instance()
+  server = context.socket(zmq.ROUTER)
+  server.setsockopt(zmq.LINGER, 0)
+  server.setsockopt(zmq.RCVTIMEO, 5000)
+  port = server.bind_to_random_port('tcp://127.0.0.1', min_port=20001, max_port=30000)
+  connection = ServerConnection('127.0.0.1', port)
+  try:
+    moved = PLAYER._replace(position=Position(1.5, 0.75))
+    connection.send('move', PLAYER)
+    connection.flush()
+    lost_request = server.recv_multipart()
+
+    connection.send('move', moved)
+    connection.flush()
+    assert server.poll(200) == 0
+
+    time.sleep(0.2)
+    connection.flush()
+    client_id, _, request_id, codec_name, command_name, data = server.recv_multipart()
+    assert (codec_name, command_name) == (b'json', b'move')
+    assert JsonCodec().decode(Player, data) == moved
+
+    server.send_multipart(lost_request[:3] + [b'1', b'null'])
+    server.send_multipart([client_id, b'', request_id, b'1', b'null'])
+    deadline = time.perf_counter() + 5
+    replies = []
+    while not replies:
+      assert time.perf_counter() < deadline
+      replies = list(connection.poll_replies())
+    assert replies == [('move', None)]
+  finally:
+    connection.close()
+    server.close()
+
+def _start_server():
+  for port in range(random.randrange(20001, 29000, 2), 30000, 2):
+    try:
+      server = Server(port, tick_rate=50, keyframe_interval=0.05)
+      break
+    except zmq.ZMQError:
+      continue
+
+  def command_fn(command_name, input_data):
+    if command_name == 'join':
+      player = PLAYER._replace(name=input_data)
+      server.emit_event('player', player)
+      return player
+    elif command_name == 'leave':
+      server.emit_event('player_left', input_data)
+    return None
+
+  threading.Thread(target=server.serve, args=(command_fn,), daemon=True).start()
+  return port
+
+def _published_codecs(events, seconds):
+  codec_names = set()
+  deadline = time.perf_counter() + seconds
+  while time.perf_counter() < deadline:
+    if events.poll(10):
+      codec_names.add(events.recv_multipart()[0].split(b'/')[0].decode())
+  return codec_names
+
+def test_server_stops_publishing_a_codec_once_its_last_client_leaves():
+  port = _start_server()
+  events = zmq.Context.instance().socket(zmq.SUB)
+  events.setsockopt(zmq.LINGER, 0)
+  events.setsockopt(zmq.SUBSCRIBE, b'')
+  events.connect('tcp://127.0.0.1:{}'.format(port + 1))
+  json_client = ServerConnection('127.0.0.1', port, codecs=('json',), timeout=5)
+  binary_client = ServerConnection('127.0.0.1', port, codecs=('binary', 'json'), timeout=5)
+  try:
+    json_client.call('join', 'json_player')
+    binary_client.call('join', 'binary_player')
+    assert _published_codecs(events, 0.3) == {'json', 'binary'}
+
+    json_client.call('leave', 'json_player')
+    _published_codecs(events, 0.1)
+    assert _published_codecs(events, 0.3) == {'binary'}
+  finally:
+    json_client.close()
+    binary_client.close()
+    events.close()
@@ -0,0 +1,189 @@
+import math
+
+from domain import *
+
+F, W, D = Material.FLOOR, Material.WALL, Material.DOOR
+MAP = Map(materials=[W, W, W, W, W, W,
+                     W, F, F, F, F, W,
+                     W, F, W, F, F, W,
+                     W, F, F, F, D, W,
+                     W, F, F, F, F, W,
+                     W, W, W, W, W, W],
+          objects=[],
+          width=6)
+
+def _directions(count):
+  angles = [2 * math.pi * i / count for i in range(count)]
+  return [Direction(math.cos(a), math.sin(a)).normalize() for a in angles] + \
+    [Direction(1.0, 0.0), Direction(0.0, -1.0), Direction(0.0, 0.0)]
+
+def test_find_first_collisions_matches_find_first_collision():
+  for start in [Position(1.5, 1.5), Position(3.25, 3.75), Position(4.9, 1.1)]:
+    for max_distance in [0.5, 2, 100]:
+      directions = _directions(64)
+      collisions = find_first_collisions(MAP, start, directions, max_distance)
+      for i, direction in enumerate(directions):
+        expected = find_first_collision(MAP, LineSegment(start, start + direction*max_distance))
+        assert collisions.hit[i] == (expected is not None)
+        if expected is not None:
+          assert (collisions.x[i], collisions.y[i]) == expected.position
+          assert collisions.distance[i] == expected.distance
+          assert collisions.wall[i] == expected.wall
+          assert SquareSide(collisions.side[i]) == expected.side
+
+def test_replace_material_returns_new_version():
+  new_map = MAP.replace_material(Position(4.5, 3.5), Material.FLOOR)
+  assert MAP.material(Position(4.5, 3.5)) == Material.DOOR
+  assert new_map.material(Position(4.5, 3.5)) == Material.FLOOR
+  assert new_map.version == MAP.version + 1
+  assert new_map.grid[3, 4] == Material.FLOOR.value
+
+def test_map_grid_is_read_only():
+  assert MAP.grid.shape == (6, 6)
+  assert not MAP.grid.flags.writeable
+
+def test_material_outside_map_is_void():
+  assert MAP.material(Position(-1.5, -0.5)) == Material.VOID
+  assert MAP.material(Position(2.5, 6.5)) == Material.VOID
+
+def test_interest_grid_tracks_player_regions():
+  grid = InterestGrid(region_size=4)
+  assert grid.update('a', Position(1.5, 1.5)) is None
+  assert grid.update('b', Position(5.5, 1.5)) is None
+  assert grid.names_in((0, 0)) == {'a'}
+  assert grid.update('a', Position(6.5, 2.5)) == (0, 0)
+  assert grid.names_in((0, 0)) == set()
+  assert grid.names_in((1, 0)) == {'a', 'b'}
+  grid.remove('b')
+  assert grid.names_in((1, 0)) == {'a'}
+  assert grid.region_of('b') is None
+
+def test_interest_grid_regions_near():
+  grid = InterestGrid(region_size=4)
+  assert sorted(grid.regions_near(Position(1.5, 5.5), radius=1)) == \
+    [(-1, 0), (-1, 1), (-1, 2), (0, 0), (0, 1), (0, 2), (1, 0), (1, 1), (1, 2)]
+
+ROOM = Map(materials=[W if x in (0, 19) or y in (0, 19) or (x, y) == (12, 7) else F for y in range(20) for x in range(20)],
+           objects=[],
+           width=20)
+
+def test_clearance_is_chebyshev_distance_to_nearest_wall():
+  assert ROOM.clearance_at(0, 0) == 0
+  assert ROOM.clearance_at(1, 1) == 1
+  assert ROOM.clearance_at(4, 5) == 4
+  assert ROOM.clearance_at(12, 9) == 2
+  assert ROOM.clearance_at(-1, 5) == 0
+
+def test_clearance_is_updated_when_material_is_replaced():
+  ROOM.clearance
+  new_room = ROOM.replace_material(Position(4.5, 5.5), Material.WALL)
+  expected = Map(new_room.cells, [], new_room.width).clearance
+  assert (new_room.clearance == expected).all()
+  assert (ROOM.replace_material(Position(12, 7), Material.FLOOR).clearance ==
+          Map(ROOM.replace_material(Position(12, 7), Material.FLOOR).cells, [], 20).clearance).all()
+
+def test_skipping_empty_space_finds_the_same_collisions():
+  for start in [Position(3.5, 4.25), Position(10.1, 10.9), Position(15.75, 2.5)]:
+    directions = _directions(256)
+    expected = find_first_collisions(ROOM, start, directions, 100)
+    collisions = find_first_collisions(ROOM, start, directions, 100, skip_empty_space=True)
+    assert (collisions.hit == expected.hit).all()
+    assert (collisions.x == expected.x).all()
+    assert (collisions.y == expected.y).all()
+    assert (collisions.side == expected.side).all()
+    assert (collisions.distance == expected.distance).all()
+
+OBJECTS = [(Object.DESK, Position(x + 0.5, y + 0.5)) for y in range(0, 40, 3) for x in range(0, 40, 3)]
+
+def test_objects_in_view_match_brute_force_search_in_depth_order():
+  index = ObjectIndex(OBJECTS)
+  half_angle = Angle.from_degrees(40)
+  for start in [Position(20.1, 20.2), Position(2.5, 37.5), Position(-5, 10)]:
+    for forward in _directions(16)[:16]:
+      expected = []
+      for i, (object, position) in enumerate(OBJECTS):
+        delta = position - start
+        angle = math.acos(max(-1, min(1, delta.normalize().dot(forward))))
+        if delta.length() <= 15 and angle <= half_angle.to_radians():
+          expected.append((delta.length(), i, (object, position)))
+      found = index.in_view(start, forward, 15, half_angle)
+      assert found == [item for _, _, item in sorted(expected)]
+
+def test_object_index_is_shared_across_map_versions():
+  world_map = Map(MAP.cells, [(Object.KEY, Position(1.5, 1.5))], MAP.width)
+  world_map.object_index
+  new_map = world_map.replace_material(Position(4.5, 3.5), Material.FLOOR)
+  assert new_map.object_index is world_map.object_index
+  assert new_map.object_index.in_view(Position(3.5, 1.5), Direction(-1, 0), 5, Angle.from_degrees(30)) == world_map.objects
+
+def test_move_with_collisions_stops_at_radius_from_wall():
+  position = move_with_collisions(MAP, Position(3.5, 1.5), Direction(2.0, 0.0), radius=0.25)
+  assert 4.74 < position.x < 4.75
+  assert position.y == 1.5
+
+def test_move_with_collisions_slides_along_walls():
+  position = move_with_collisions(MAP, Position(3.5, 1.5), Direction(1.0, -1.0), radius=0.25)
+  assert position.x == 4.5
+  assert 1.25 < position.y < 1.26
+
+def test_move_with_collisions_checks_every_cell_the_player_overlaps():
+  assert move_with_collisions(MAP, Position(1.5, 3.5), Direction(0.0, -1.0), radius=0.25) == Position(1.5, 2.5)
+  assert 3.6 < move_with_collisions(MAP, Position(1.6, 3.7), Direction(0.0, -1.0), radius=0.6).y < 3.61
+
+WALL_ROW = Map(materials=[F, F, F, F, F, W, F, F,
+                          F, F, F, F, F, W, F, F,
+                          F, F, F, F, F, W, F, F],
+               objects=[],
+               width=8)
+
+def test_move_with_collisions_does_not_enter_a_wall_the_player_already_touches():
+  position = Position(4.9, 1.5)
+  for _ in range(4):
+    position = move_with_collisions(WALL_ROW, position, Direction(0.3, 0.0), radius=0.25)
+    assert position == Position(4.9, 1.5)
+  assert move_with_collisions(WALL_ROW, position, Direction(-0.3, 0.0), radius=0.25).x < 4.9
+
+def test_moves_with_collisions_matches_move_with_collisions():
+  starts = [Position(4.9, 1.5), Position(6.1, 1.5), Position(3.5, 1.5), Position(1.5, 0.3), Position(5.5, 1.5)]
+  deltas = [Direction(0.3, 0.0), Direction(-0.3, 0.0), Direction(2.0, 0.2), Direction(0.0, 0.0)]
+  for delta in deltas:
+    positions = moves_with_collisions(WALL_ROW, starts, [delta]*len(starts), radius=0.25)
+    assert [tuple(position) for position in positions.tolist()] == [tuple(move_with_collisions(WALL_ROW, start, delta, 0.25)) for start in starts]
+  assert moves_with_collisions(WALL_ROW, [Position(4.9, 1.5)], [Direction(0.3, 0.0)], radius=0.25).tolist() == [[4.9, 1.5]]
+
+def test_move_with_collisions_lets_a_player_walk_out_of_a_door_closed_on_them():
+  position = Position(4.5, 3.5)
+  for _ in range(2):
+    position = move_with_collisions(MAP, position, Direction(-0.5, 0.0), radius=0.25)
+  assert position == Position(3.5, 3.5)
+  assert move_with_collisions(MAP, position, Direction(0.5, 0.0), radius=0.25).x < 3.75
+  assert move_with_collisions(MAP, Position(4.5, 3.5), Direction(0.0, 0.5), radius=0.25) == Position(4.5, 4.0)
+
+def test_moves_with_collisions_lets_a_player_walk_out_of_a_door_closed_on_them():
+  positions = [Position(4.5, 3.5)]*2
+  deltas = [Direction(-0.5, 0.0), Direction(0.0, 0.5)]
+  for _ in range(2):
+    positions = moves_with_collisions(MAP, positions, deltas, radius=0.25)
+  assert positions.tolist() == [[3.5, 3.5], [4.5, 4.5]]
+  assert moves_with_collisions(MAP, positions[:1], [Direction(0.5, 0.0)], radius=0.25)[0, 0] < 3.75
+
+def test_player_replace_sets_only_the_given_fields():
+  player = Player('test', Position(1.5, 1.5), Direction(1.0, 0.0))
+  assert player._replace(position=Position(2.0, 1.5)) == Player('test', Position(2.0, 1.5), Direction(1.0, 0.0))
+  assert player._replace(position=None) == Player('test', None, Direction(1.0, 0.0))
+  assert type(player._replace()) is Player and player._replace() == player
+
+def test_player_table_stores_players_in_contiguous_arrays():
+  players = [Player('p{}'.format(i), Position(i + 0.5, 1.5), Direction(1.0, 0.0)) for i in range(20)]
+  table = PlayerTable(players, capacity=4)
+  assert len(table) == 20
+  assert table['p7'] == players[7]
+  assert table.positions[:, 0].tolist() == [i + 0.5 for i in range(20)]
+
+  assert table.pop('p3') == players[3]
+  assert 'p3' not in table
+  assert table['p19'] == players[19]
+  assert sorted(table.values()) == sorted(players[:3] + players[4:])
+
+  table['p19'] = players[19]._replace(position=Position(2.0, 2.0))
+  assert table.players([table.index('p19')]) == [players[19]._replace(position=Position(2.0, 2.0))]
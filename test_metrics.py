@@ -0,0 +1,35 @@
+import io
+import json
+
+from metrics import *
+
+def test_summary_reports_counters_and_histograms():
+  metrics = Metrics()
+  metrics.count('commands')
+  metrics.count('commands', 2)
+  for value in [1, 2, 3, 4]:
+    metrics.add('latency', value)
+  summary = metrics.summary()
+  assert summary['counters'] == {'commands': 3}
+  assert summary['histograms']['latency'] == {'count': 4, 'mean': 2.5, 'p50': 2, 'p99': 4, 'max': 4}
+
+def test_periodic_dump_writes_json_lines_and_starts_a_new_interval():
+  metrics = Metrics()
+  file = io.StringIO()
+  dump = PeriodicDump(metrics, file, interval=0)
+  metrics.count('events', 5)
+  dump.update()
+  dump.update()
+  first, second = [json.loads(line) for line in file.getvalue().splitlines()]
+  assert first['counters'] == {'events': 5}
+  assert second['counters'] == {}
+
+def test_periodic_dump_can_write_the_current_interval_early():
+  metrics = Metrics()
+  file = io.StringIO()
+  dump = PeriodicDump(metrics, file, interval=60)
+  metrics.count('events')
+  dump.update()
+  assert file.getvalue() == ''
+  dump.dump()
+  assert json.loads(file.getvalue())['counters'] == {'events': 1}
@@ -0,0 +1,40 @@
+from server_use_case import *
+from domain import Direction, initial_input, InputAck, Map, MapDelta, Material, Player, PlayerInput, Position
+
+MAP = Map(materials=[Material.FLOOR, Material.FLOOR, Material.FLOOR,
+                     Material.FLOOR, Material.FLOOR, Material.FLOOR,
+                     Material.FLOOR, Material.FLOOR, Material.DOOR],
+          objects=[],
+          width=3)
+SPAWN = Player(name='spawn',
+               position=Position(0.5, 0.5),
+               forward=Direction(1.0, 0.0))
+LINKS = {Position(0, 0): Position(2, 2)}
+
+def test_activate_emits_map_delta():
+  state = initial_state(SPAWN, MAP, LINKS)
+  state, player, _ = handle_command(state, 'join', 'test')
+  state, _, events = handle_command(state, 'activate', 'test')
+  assert state.world_map.material(Position(2, 2)) == Material.FLOOR
+  assert events == [('map_delta', MapDelta(version=1, changes=[(Position(2, 2), Material.FLOOR)]))]
+
+def test_authoritative_tick_moves_players_from_their_inputs():
+  state = initial_state(SPAWN, MAP, LINKS, authoritative=True)
+  state, _, _ = handle_command(state, 'join', 'test')
+  state, _, _ = handle_command(state, 'join', 'idle')
+  state, ack, _ = handle_command(state, 'input', PlayerInput('test', 1, initial_input._replace(forward=True)))
+  assert ack == InputAck(1, state.players['test'])
+  state, events = handle_tick(state, 0.05)
+  assert state.players['test'].position.x > 0.5
+  assert state.players['idle'].position == SPAWN.position
+  assert events == [('player', state.players['test'])]
+
+def test_restored_snapshot_keeps_players_and_inputs():
+  state = initial_state(SPAWN, MAP, LINKS, authoritative=True)
+  state, _, _ = handle_command(state, 'join', 'test')
+  state, _, _ = handle_command(state, 'input', PlayerInput('test', 1, initial_input._replace(forward=True)))
+  state, _ = handle_tick(state, 0.05)
+  restored = restore_snapshot(initial_state(SPAWN, MAP, LINKS, authoritative=True), take_snapshot(state))
+  assert restored.players.values() == state.players.values()
+  assert restored.inputs == state.inputs
+  assert handle_tick(restored, 0.05)[1] == handle_tick(state, 0.05)[1]
@@ -1,5 +1,7 @@
+import numpy
+
 from use_case import *
-from domain import Direction, initial_input, Map, Material, Position
+from domain import Direction, initial_input, InputAck, Map, MapDelta, Material, PlayerInput, Position
 
 MAP = Map(materials=[Material.FLOOR, Material.FLOOR, Material.FLOOR,
                      Material.FLOOR, Material.FLOOR, Material.FLOOR,
@@ -27,3 +29,85 @@ def test_turn_right():
   assert state.player.position.y == 1.5
   assert state.player.forward.x > 0.0
   assert state.player.forward.y > -1.0
+
+def test_map_delta_is_applied():
+  state = initial_state(initial_input, PLAYER, MAP, 3, 5)
+  delta = MapDelta(version=1, changes=[(Position(0, 0), Material.DOOR)])
+  state, commands = handle_event(state, 'map_delta', delta)
+  assert state.world_map.material(Position(0, 0)) == Material.DOOR
+  assert state.world_map.version == 1
+  assert commands == []
+
+def test_map_delta_version_gap_requests_world_map():
+  state = initial_state(initial_input, PLAYER, MAP, 3, 5)
+  delta = MapDelta(version=2, changes=[(Position(0, 0), Material.DOOR)])
+  state, commands = handle_event(state, 'map_delta', delta)
+  assert state.world_map == MAP
+  assert commands == [('get_world_map', None)]
+
+def test_world_map_from_a_restarted_server_replaces_a_newer_version():
+  state = initial_state(initial_input, PLAYER, MAP.apply_delta(MapDelta(version=5, changes=[])), 3, 5)
+  state, commands = handle_event(state, 'map_delta', MapDelta(version=1, changes=[(Position(0, 0), Material.DOOR)]))
+  assert commands == [('get_world_map', None)]
+  restarted_map = MAP.replace_material(Position(0, 0), Material.DOOR)
+  state, _ = handle_event(state, 'world_map', restarted_map)
+  assert state.world_map == restarted_map
+  state, _ = handle_event(state, 'map_delta', MapDelta(version=2, changes=[(Position(0, 0), Material.FLOOR)]))
+  assert state.world_map.version == 2
+
+def test_authoritative_client_predicts_and_reconciles_with_acks():
+  state = initial_state(initial_input, PLAYER, MAP, 3, 5, authoritative=True)
+  forward = initial_input._replace(forward=True)
+  state, commands = handle_event(state, 'input', forward)
+  assert commands == [('input', PlayerInput('test', 1, forward))]
+  state, commands = handle_event(state, 'tick', 0.070)
+  assert state.player.position.y < 1.5
+  assert commands == []
+  predicted = state.player
+  state, _ = handle_event(state, 'input_ack', InputAck(1, PLAYER._replace(position=Position(1.5, 1.4))))
+  assert state.player.position.x == predicted.position.x
+  assert abs(state.player.position.y - (predicted.position.y - 0.1)) < 1e-9
+  assert state.pending_inputs == ()
+
+def test_reconciling_shifts_the_predictions_still_in_flight():
+  state = initial_state(initial_input, PLAYER, MAP, 3, 5, authoritative=True)
+  forward = initial_input._replace(forward=True)
+  state, _ = handle_event(state, 'input', forward)
+  state, _ = handle_event(state, 'tick', 0.05)
+  state, _ = handle_event(state, 'input', initial_input)
+  first, second = [player for _, player in state.pending_inputs]
+  predicted = state.player
+
+  state, _ = handle_event(state, 'input_ack', InputAck(1, first._replace(position=first.position + Direction(0.1, 0.0))))
+  assert abs(state.player.position.x - (predicted.position.x + 0.1)) < 1e-9
+  state, _ = handle_event(state, 'input_ack', InputAck(2, second._replace(position=second.position + Direction(0.1, 0.0))))
+  assert abs(state.player.position.x - (predicted.position.x + 0.1)) < 1e-9
+  assert state.player.position.y == predicted.position.y
+  assert state.pending_inputs == ()
+
+def test_other_players_are_interpolated_between_snapshots():
+  state = initial_state(initial_input, PLAYER, MAP, 3, 5, interpolation_delay=0.1)
+  other = Player('other', Position(0.5, 0.5), Direction(1.0, 0.0))
+  state, _ = handle_event(state, 'player', other)
+  state, _ = handle_event(state, 'tick', 0.1)
+  state, _ = handle_event(state, 'player', other._replace(position=Position(1.5, 0.5)))
+  state, _ = handle_event(state, 'tick', 0.05)
+  assert [player.position for player in interpolate_players(state)] == [Position(1.0, 0.5)]
+  state, _ = handle_event(state, 'player_left', 'other')
+  assert interpolate_players(state) == []
+
+def test_silent_players_expire():
+  state = initial_state(initial_input, PLAYER, MAP, 3, 5)
+  state, _ = handle_event(state, 'player', Player('other', Position(0.5, 0.5), Direction(1.0, 0.0)))
+  for _ in range(40):
+    state, _ = handle_event(state, 'tick', 0.1)
+  assert state.other_players == {}
+
+def test_batched_movement_matches_move_player():
+  players = [PLAYER, PLAYER._replace(forward=Direction(0.6, 0.8)), PLAYER._replace(forward=Direction(-1.0, 0.0))]
+  forward = initial_input._replace(forward=True, turn_right=True)
+  expected = [move_player(rotate_player(player, forward, 0.2, 3), MAP, forward, 0.2, 5) for player in players]
+  forwards = rotate_players(numpy.array([player.forward for player in players]), numpy.ones(3, dtype=bool), 0.2, 3)
+  positions = move_players(numpy.array([player.position for player in players]), forwards, numpy.ones(3, dtype=bool), MAP, 0.2, 5)
+  assert positions.tolist() == [list(player.position) for player in expected]
+  assert forwards.tolist() == [list(player.forward) for player in expected]
@@ -1,8 +1,16 @@
 from collections import namedtuple
+import math
+import numpy
 
-from domain import Angle, find_first_collision, initial_input, LineSegment, Player, Position
+from domain import Angle, Direction, initial_input, move_with_collisions, moves_with_collisions, Player, PlayerInput, Position
 
-_State = namedtuple('State', 'input, player, world_map, rotation_speed, movement_speed, other_players')
+_State = namedtuple('State', 'input, player, world_map, rotation_speed, movement_speed, player_radius, authoritative, other_players, time, sequence, pending_inputs, interpolation_delay')
+_Snapshot = namedtuple('_Snapshot', 'time, player')
+
+_PLAYER_RADIUS = 0.25
+_INTERPOLATION_DELAY = 0.1
+_MAX_SNAPSHOTS = 8
+_PLAYER_TIMEOUT = 3.0
 
 def rotate_player(player, input, frame_time, speed):
   rotation_sign = (1 if input.turn_right else 0)
@@ -14,28 +22,64 @@ def rotate_player(player, input, frame_time, speed):
   new_forward = player.forward.rotate(rotation_delta)
   return player._replace(forward=new_forward)
 
-def _try_to_move(map, from_, to):
-  return to if find_first_collision(map, LineSegment(from_, to)) is None else from_
-
-def move_player(player, map, input, frame_time, speed):
+def move_player(player, map, input, frame_time, speed, radius=_PLAYER_RADIUS):
   movement_sign = (1 if input.forward else 0)
 
   if movement_sign == 0:
     return player
 
   movement_delta = player.forward*(movement_sign * speed * frame_time)
-  new_position = Position(player.position.x, player.position.y)
+  new_position = move_with_collisions(map, player.position, movement_delta, radius)
+  return player._replace(position=new_position)
 
-  x_target = Position(new_position.x + movement_delta.x, new_position.y)
-  new_position = _try_to_move(map, from_=new_position, to=x_target)
+def rotate_players(forwards, turning, frame_time, speed):
+  radians = speed * frame_time
+  cos, sin = math.cos(radians), math.sin(radians)
+  x, y = forwards[:, 0], forwards[:, 1]
+  rotated = numpy.stack((x*cos - y*sin, x*sin + y*cos), axis=-1)
+  return numpy.where(turning[:, numpy.newaxis], rotated, forwards)
 
-  y_target = Position(new_position.x, new_position.y + movement_delta.y)
-  new_position = _try_to_move(map, from_=new_position, to=y_target)
+def move_players(positions, forwards, moving, map, frame_time, speed, radius=_PLAYER_RADIUS):
+  deltas = numpy.where(moving[:, numpy.newaxis], forwards*(speed * frame_time), 0.0)
+  return moves_with_collisions(map, positions, deltas, radius)
 
-  return player._replace(position=new_position)
+def _interpolate_player(snapshots, time):
+  later = next((i for i, snapshot in enumerate(snapshots) if snapshot.time > time), len(snapshots))
+  if later == 0 or later == len(snapshots):
+    return snapshots[min(later, len(snapshots) - 1)].player
+
+  before, after = snapshots[later - 1], snapshots[later]
+  t = (time - before.time) / (after.time - before.time)
+  position = before.player.position + (after.player.position - before.player.position)*t
+  forward = (before.player.forward + (after.player.forward - before.player.forward)*t).normalize()
+  return after.player._replace(position=position, forward=forward)
+
+def interpolate_players(state):
+  render_time = state.time - state.interpolation_delay
+  return [_interpolate_player(snapshots, render_time) for snapshots in state.other_players.values()]
+
+def _reconcile(state, ack):
+  predicted = next((player for sequence, player in state.pending_inputs if sequence == ack.sequence), None)
+  pending_inputs = tuple((sequence, player) for sequence, player in state.pending_inputs if sequence > ack.sequence)
+  if predicted is None:
+    return state._replace(pending_inputs=pending_inputs)
+
+  position_error = ack.player.position - predicted.position
+  rotation = Angle.from_radians(math.atan2(predicted.forward.x*ack.player.forward.y - predicted.forward.y*ack.player.forward.x, predicted.forward.dot(ack.player.forward)))
+
+  def correct(player):
+    return player._replace(position=player.position + position_error, forward=player.forward.rotate(rotation))
+
+  pending_inputs = tuple((sequence, correct(player)) for sequence, player in pending_inputs)
+  return state._replace(player=correct(state.player), pending_inputs=pending_inputs)
+
+def _expire_other_players(state):
+  for name, snapshots in list(state.other_players.items()):
+    if state.time - snapshots[-1].time > _PLAYER_TIMEOUT:
+      del state.other_players[name]
 
-def initial_state(initial_input, player, world_map, rotation_speed, movement_speed):
-  return _State(initial_input, player, world_map, rotation_speed, movement_speed, {})
+def initial_state(initial_input, player, world_map, rotation_speed, movement_speed, player_radius=_PLAYER_RADIUS, authoritative=False, interpolation_delay=_INTERPOLATION_DELAY):
+  return _State(initial_input, player, world_map, rotation_speed, movement_speed, player_radius, authoritative, {}, 0.0, 0, (), interpolation_delay)
 
 def handle_event(state, event_name, event_data):
   commands = []
@@ -43,13 +87,39 @@ def handle_event(state, event_name, event_data):
     frame_time = event_data
     player = state.player
     player = rotate_player(player, state.input, frame_time, state.rotation_speed)
-    player = move_player(player, state.world_map, state.input, frame_time, state.movement_speed)
-    if player != state.player:
+    player = move_player(player, state.world_map, state.input, frame_time, state.movement_speed, state.player_radius)
+    if player != state.player and not state.authoritative:
       commands.append(('move', player))
-    state = state._replace(player=player)
+    state = state._replace(player=player, time=state.time + frame_time)
+    _expire_other_players(state)
   elif event_name == 'input':
     new_input = event_data
+    if state.authoritative and new_input != state.input:
+      sequence = state.sequence + 1
+      commands.append(('input', PlayerInput(state.player.name, sequence, new_input)))
+      state = state._replace(sequence=sequence, pending_inputs=state.pending_inputs + ((sequence, state.player), ))
     state = state._replace(input=new_input)
+  elif event_name == 'input_ack':
+    state = _reconcile(state, event_data)
+  elif event_name == 'player':
+    player = event_data
+    if player.name != state.player.name:
+      snapshots = state.other_players.get(player.name, ()) + (_Snapshot(state.time, player), )
+      state.other_players[player.name] = snapshots[-_MAX_SNAPSHOTS:]
+    elif state.authoritative and not state.pending_inputs and not (state.input.forward or state.input.turn_right):
+      state = state._replace(player=player)
+  elif event_name == 'player_left':
+    name = event_data
+    state.other_players.pop(name, None)
+  elif event_name == 'map_delta':
+    delta = event_data
+    if delta.version == state.world_map.version + 1:
+      state = state._replace(world_map=state.world_map.apply_delta(delta))
+    else:
+      commands.append(('get_world_map', None))
+  elif event_name == 'world_map':
+    world_map = event_data
+    state = state._replace(world_map=world_map)
   else:
     # TODO: implement more events
     pass